@@ -0,0 +1,214 @@
+''' Asyncio runtime for the Controller, Generic, Voter, SBB and Mix servers
+
+    Servers are still created as socketserver.TCPServer objects (binding, roles and state are
+    unchanged), but an event loop accepts and serves the connections on their listening socket.
+    Messages are read and written without blocking the loop and handle_request runs in a thread
+    pool, so a server keeps receiving from its peers while one of its handlers sends to others.
+    Handlers send to several servers at once with json_client_many, which awaits async_json_client
+    on the event loop of the server.
+
+    Messages use the same framing as ServerController.json_client,
+    SC.SERVER_RUNTIME selects this runtime or socketserver's threads (see start_server_thread)
+'''
+import asyncio
+import collections
+import concurrent.futures
+import struct
+import threading
+import ServerConfiguration as SC##information about network
+import ServerController
+from ServerController import json_client
+import sv
+
+MSG_HEADER_SIZE = struct.calcsize(SC.MSG_HEADER_FORMAT)
+
+# idle (reader, writer) connections per (ip, port), only used from the event loop thread
+async_connection_pool = dict()
+
+def start_server_thread(server):
+    """ Serve server in a daemon thread, with the runtime selected by SC.SERVER_RUNTIME """
+    if SC.SERVER_RUNTIME == SC.RUNTIME_ASYNCIO:
+        server_thread = threading.Thread(target=serve_forever, args=(server,), daemon = True)
+    else:
+        server_thread = threading.Thread(target=server.serve_forever, daemon = True)
+    #daemon threads allow us to finish the program execution, even though some threads may be running
+    server_thread.start()
+    return server_thread
+
+def serve_forever(server):
+    """ Run the event loop of server, like socketserver's serve_forever it never returns """
+    asyncio.run(serve(server))
+
+async def serve(server):
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers = SC.MAX_CONCURRENT_REQUESTS))
+    # handlers running in the pool use it to await requests to other servers
+    server.loop = loop
+
+    async def handle_connection(reader, writer):
+        await serve_connection(server, reader, writer)
+
+    async_server = await asyncio.start_server(handle_connection, sock = server.socket)
+    async with async_server:
+        await async_server.serve_forever()
+
+async def serve_connection(server, reader, writer):
+    """ ServerX -> Server [Any request]
+    Serve requests until the client closes the connection, like GenericHandler.handle
+    """
+    loop = asyncio.get_running_loop()
+    client_address = writer.get_extra_info('peername')
+    try:
+        while True:
+            received = await async_recv_message(reader)
+            if received is None:
+                break
+            request_data = ServerController.load_request(*received)
+            # a previous request may have assigned a role to the server, use its handler from now on
+            handler = make_handler(server, client_address)
+            response = await loop.run_in_executor(None, handler.handle_request, request_data)
+            print("--->" + str(request_data[SC.MSG_ORIGIN]))
+            print("\t" + SC.MSG_TITLE + ": " + str(response[SC.MSG_TITLE]))
+            await async_send_message(writer, response, ServerController.choose_encoding(request_data.get(SC.MSG_ACCEPT_ENCODING)))
+    finally:
+        writer.close()
+
+def make_handler(server, client_address):
+    """ Return a handler of the current RequestHandlerClass of server, without running its handle(),
+    which would read the connection itself """
+    RequestHandlerClass = server.RequestHandlerClass
+    handler = RequestHandlerClass.__new__(RequestHandlerClass)
+    handler.server = server
+    handler.client_address = client_address
+    handler.request = None
+    return handler
+
+async def async_json_client(ip, port, title, origin, body = "empty body", auth = "empty auth", attachment = None):
+    """ Awaitable version of ServerController.json_client, to be run on the event loop of a server """
+    message = {SC.MSG_TITLE: title, SC.MSG_BODY: body , SC.MSG_ORIGIN: origin, SC.MSG_AUTH: auth}
+    if attachment is not None:
+        message[SC.MSG_ATTACHMENT] = attachment
+    if ip == "":
+        ip = "127.0.0.1"
+    destination_str = str([ip, port])
+    print("--->" + destination_str)
+    print("\t" + SC.MSG_TITLE + ": " + str(message[SC.MSG_TITLE]))
+    loop = asyncio.get_running_loop()
+    encoding = ServerController.choose_encoding(ServerController.peer_encodings.get((ip, port)))
+    # sdb updates are large, serialize (and compress) them without holding up the loop
+    frame = await loop.run_in_executor(None, ServerController.frame_message, message, encoding)
+    reader, writer, reused = await async_get_connection(ip, port)
+    try:
+        received = await async_send_frame_and_recv(reader, writer, frame)
+        if received is None:
+            raise ConnectionResetError("Connection closed by " + destination_str)
+    except OSError:
+        writer.close()
+        if not reused:
+            raise
+        # the pooled connection went stale (peer restarted), retry once on a new one
+        reader, writer = await async_open_connection(ip, port)
+        received = await async_send_frame_and_recv(reader, writer, frame)
+        if received is None:
+            writer.close()
+            raise ConnectionResetError("Connection closed by " + destination_str)
+    raw_response_string, response_attachment = received
+    response = sv.loads(raw_response_string)
+    ServerController.add_attachment(response, response_attachment)
+    ServerController.peer_encodings[(ip, port)] = response.get(SC.MSG_ACCEPT_ENCODING)
+    print("<---" + destination_str)
+    print("\t" + SC.MSG_TITLE + ": " + str(response[SC.MSG_TITLE]))
+    async_connection_pool.setdefault((ip, port), []).append((reader, writer))
+    return response
+
+def json_client_many(requests, origin, loop = None, attachment = None):
+    """ Send each (server, title, body) request at the same time and wait for all the responses,
+    returned in the order of the requests. The same attachment, if any, goes with every request.
+    Called from a handler thread: loop is the event loop of the server (server.loop) that awaits them.
+    Without a loop (socketserver runtime) the requests are sent one after the other. """
+    if loop is None:
+        return [json_client(ip = s[0], port = s[1], title = title, body = body, origin = origin, auth = "", attachment = attachment)
+                for (s, title, body) in requests]
+    return asyncio.run_coroutine_threadsafe(gather_responses(requests, origin, attachment), loop).result()
+
+def json_client_stream(requests, origin, loop = None, window = SC.STREAM_WINDOW):
+    """ Send each (servers, title, body, attachment) request of the iterable requests to all of its servers.
+    At most window requests are in flight: requests is only advanced once an earlier request has been
+    answered by all its servers, so memory stays bounded when its items are built on demand.
+    Called from a handler thread, like json_client_many """
+    pending = collections.deque()
+    for (servers, title, body, attachment) in requests:
+        if len(pending) >= window:
+            pending.popleft().result()
+        if loop is None:
+            json_client_many([(s, title, body) for s in servers], origin, attachment = attachment)
+        else:
+            pending.append(asyncio.run_coroutine_threadsafe(gather_responses([(s, title, body) for s in servers], origin, attachment), loop))
+    for future in pending:
+        future.result()
+
+async def gather_responses(requests, origin, attachment):
+    return await asyncio.gather(*[async_json_client(ip = s[0], port = s[1], title = title, body = body, origin = origin, auth = "", attachment = attachment)
+                                  for (s, title, body) in requests])
+
+async def async_get_connection(ip, port):
+    """ Return (reader, writer, reused) for a connection to (ip, port), taken from the pool when one is idle """
+    idle_connections = async_connection_pool.get((ip, port))
+    if idle_connections:
+        reader, writer = idle_connections.pop()
+        return reader, writer, True
+    reader, writer = await async_open_connection(ip, port)
+    return reader, writer, False
+
+async def async_open_connection(ip, port):
+    """ Connect to (ip, port), waiting for the peer to start listening if needed.
+    asyncio already sets TCP_NODELAY on its connections """
+    retry_interval = SC.CONNECT_RETRY_INTERVAL
+    while True:
+        try:
+            return await asyncio.open_connection(ip, port)
+        except ConnectionRefusedError:
+            print("Connection Refused Error, trying again")
+            await asyncio.sleep(retry_interval)
+            retry_interval = min(2 * retry_interval, SC.CONNECT_RETRY_INTERVAL_MAX)
+
+async def async_send_frame_and_recv(reader, writer, frame):
+    writer.write(frame)
+    await writer.drain()
+    return await async_recv_message(reader)
+
+async def async_send_message(writer, message, encoding = None):
+    """ Serialize message and send it prefixed by its header """
+    writer.write(ServerController.frame_message(message, encoding))
+    await writer.drain()
+
+async def async_recv_message(reader):
+    """ Receive one message and return (message string, attachment bytes or None).
+    Returns None if the connection is closed before a message starts. """
+    try:
+        header = await reader.readexactly(MSG_HEADER_SIZE)
+    except asyncio.IncompleteReadError as e:
+        assert len(e.partial) == 0, "Connection closed in the middle of a message header"
+        return None
+    (flags, length, attachment_length) = struct.unpack(SC.MSG_HEADER_FORMAT, header)
+    payload = await async_recv_exactly(reader, length)
+    attachment = None
+    if attachment_length > 0:
+        attachment = await async_recv_exactly(reader, attachment_length)
+    return ServerController.unframe_message(flags, payload, attachment)
+
+async def async_recv_exactly(reader, n):
+    """ Receive exactly n bytes into a bytearray allocated once, like ServerController.recv_exactly.
+    Each read takes what the StreamReader has buffered (at most about twice its limit), so its buffer
+    does not grow to the size of the message and the message is not copied again at the end,
+    as it would be by readexactly """
+    data = bytearray(n)
+    view = memoryview(data)
+    received = 0
+    while received < n:
+        chunk = await reader.read(n - received)
+        if len(chunk) == 0:
+            raise asyncio.IncompleteReadError(bytes(view[:received]), n)
+        view[received:received + len(chunk)] = chunk
+        received += len(chunk)
+    return data
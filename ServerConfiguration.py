@@ -6,11 +6,72 @@ MSG_TITLE = 'title'
 MSG_BODY = 'body'
 MSG_ORIGIN = 'origin'
 MSG_AUTH = 'auth'
-MSG_BUFFER_SIZE = 8192 #10000000 #100000000 # 262144# 65536 #8192 TODO fix
+MSG_ATTACHMENT = 'attachment' # optional binary part of a message (bytes), sent after the JSON
+MSG_ACCEPT_ENCODING = 'accept_encoding' # compressions the sender of a message can decompress
+MSG_HEADER_FORMAT = '!BQQ' # compression flags, lengths (in bytes) of the JSON and of the attachment, sent in front of every message
+
+# connections to other servers are kept open and reused (see connection_pool in ServerController.py)
+CONNECT_RETRY_INTERVAL = 0.001 # seconds before retrying a refused connection, doubled after each retry
+CONNECT_RETRY_INTERVAL_MAX = 0.5
+MAX_CONCURRENT_REQUESTS = 32 # number of servers the controller talks to, or requests a server handles, at the same time
+
+# how servers serve their connections: a socketserver thread per connection, or one asyncio
+# event loop per server running handlers in a thread pool (see ServerAsync.py)
+RUNTIME_THREADS = "threads"
+RUNTIME_ASYNCIO = "asyncio"
+SERVER_RUNTIME = RUNTIME_ASYNCIO
+
+# prove phases in which every Mix server reads the SBB hash before the last one posts
+# its challenges, the controller asks the servers one at a time in these phases
+PROVE_PHASES_SERIAL = [1, 6]
 
 # Message Encoding Format
 ENCODING_TYPE = 'UTF-8' # other UNICODE, ASCII
 
+# large messages are compressed for servers that advertised they accept it (see ServerController.frame_message)
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_LZMA = "lzma"
+ACCEPT_ENCODINGS = [COMPRESSION_ZLIB, COMPRESSION_LZMA] # compressions this server can decompress
+COMPRESSION = COMPRESSION_ZLIB # compression used for large messages, None to never compress
+COMPRESSION_THRESHOLD = 65536 # bytes, smaller messages are sent as they are
+COMPRESSION_LEVEL = 1 # zlib level or lzma preset, favors speed
+
+# encoding of the sdb updates exchanged by Mix servers: JSON only, or vectors moved to a
+# binary attachment (see sv_codec.py)
+SDB_CODEC_JSON = "json"
+SDB_CODEC_BINARY = "binary"
+SDB_CODEC = SDB_CODEC_BINARY
+
+# large updates (votes, sdb updates, proof shares) are streamed as a sequence of requests, each carrying
+# the entries of at most STREAM_CHUNK_SIZE voters, with at most STREAM_WINDOW requests in flight
+STREAM_CHUNK_SIZE = 1000
+STREAM_WINDOW = 4
+
+# permutations of the mix: row 'a' sends the other rows one seed per (race, column) and each row
+# regenerates the permutations from it, instead of sending them
+PERMUTATION_SEEDS = True
+# obfuscation values of the mix: likewise, each row derives its shares of 0 from keys sent by row 'a',
+# getting only the keys of its own shares (a pseudorandom zero-sharing), instead of receiving them
+FUZZ_SEEDS = True
+
+# outputs of the mix: the last column keeps its y's, and each server computing the tally fetches the
+# passes it needs (k in opl) from just enough other rows; otherwise the last column sends all its y's
+# to every other row of the column
+FETCH_OUTPUTS = True
+
+# pipelined mixing: all columns are asked to mix at once, each Mix server forwards every (race, k) pass
+# to the next column as soon as it is mixed, and mixes a pass as soon as its inputs have arrived;
+# otherwise columns mix one after the other, each shipping all of its passes at the end
+MIX_PIPELINED = False
+
+# parallel mixing: each Mix server mixes the (race, k) passes of its column with sv_parallel.map_work,
+# i.e. in a pool of WORKER_PROCESSES worker processes. Off by default: a pass is cheap next to sending
+# its vectors to a worker, so this pays off only for large elections on mix hosts with several cores
+PARALLEL_MIXING = False
+# worker processes of sv_parallel.map_work (also used for the output commitments of the proof);
+# 1 means compute in the calling process
+WORKER_PROCESSES = 1
+
 # list of server roles
 ROLE_GENERIC = "Generic Server"
 ROLE_VOTER = "Voter Server"
@@ -36,6 +97,7 @@ MESSAGE_DISTRIBUTE_VOTES = "5.a Distribute votes" # Controller -> Voter
 MESSAGE_SPLIT_VALUE_VOTES = "5.b Split Value Votes" # Voter -> Mix Servers
 MESSAGE_MIX = "6 Mix" # Controller -> Mix Servers
 MESSAGE_UPDATE_SDB_DATABASE = "6.b Updating SDB" # Mix Servers -> Mix Servers
+MESSAGE_FETCH_SDB = "6.c Fetching SDB" # Mix Servers -> Mix Servers
 MESSAGE_PROVE = "7 Prove" # Controller -> Mix Servers
 MESSAGE_TALLY = "8 Tally" # Controller -> Mix Servers
 MESSAGE_VERIFY = "-1 Verify SBB"
@@ -16,15 +16,24 @@ import socket
 import sys
 import time
 import json
+import concurrent.futures
 
-class ControllerServer(socketserver.TCPServer):
-    """ Here we keep any relevant states for our server """
+class ControllerServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """ Here we keep any relevant states for our server
+    Each connection is served in its own thread, since clients keep their connections open """
+    daemon_threads = True
 
-    def __init__(self, server_address, RequestHandlerClass):
+    def __init__(self, server_address, RequestHandlerClass, election = None):
         socketserver.TCPServer.__init__(self, server_address, RequestHandlerClass)
+        # the election being run, election.server gives the geometry of the Mix server array
+        self.election = election
+        # event loop serving the requests when running the asyncio runtime (see ServerAsync.py)
+        self.loop = None
         self.servers_alive = {SC.ROLE_GENERIC: [], SC.ROLE_VOTER: [], SC.ROLE_CONTROLLER: [], SC.ROLE_SBB: [], SC.ROLE_MIX: [],
                             SC.ROLE_VOTER+"_PENDING": [], SC.ROLE_SBB+"_PENDING": [], SC.ROLE_MIX+"_PENDING": []}
         self.role = SC.ROLE_CONTROLLER
+        # used to send the same phase to many servers at once
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = SC.MAX_CONCURRENT_REQUESTS)
 
     def wait_for_servers(self, num_servers_per_role):
         n = sum([len(l) for l in self.servers_alive.values()]) # total number of servers alive
@@ -36,44 +45,28 @@ class ControllerServer(socketserver.TCPServer):
             n = sum([len(l) for l in self.servers_alive.values()]) # total number of servers alive
     
     def assign_server_roles(self, num_servers_per_role, initialization_params_per_role):
-        while len(self.servers_alive[SC.ROLE_VOTER]) < num_servers_per_role[SC.ROLE_VOTER]:
-            # if pending list not empty get it from there otherwise get it from generic
-            s = None
-            assert len(self.servers_alive[SC.ROLE_VOTER + "_PENDING"]) + len(self.servers_alive[SC.ROLE_GENERIC]) > 0, "Incorrect Number of Servers" + str(num_servers_per_role)
-            if len(self.servers_alive[SC.ROLE_VOTER + "_PENDING"]) > 0:
-                s = self.servers_alive[SC.ROLE_VOTER + "_PENDING"].pop()
-            else: # len(self.servers_alive[SC.ROLE_GENERIC]) > 0:
-                s = self.servers_alive[SC.ROLE_GENERIC].pop()
-            response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_ASSIGN_ROLE_VOTER, body = initialization_params_per_role[SC.ROLE_VOTER], origin = (SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), auth = "")
+        role_titles = [(SC.ROLE_VOTER, SC.MESSAGE_ASSIGN_ROLE_VOTER), (SC.ROLE_SBB, SC.MESSAGE_ASSIGN_ROLE_SBB), (SC.ROLE_MIX, SC.MESSAGE_ASSIGN_ROLE_MIX)]
+        requests = []
+        roles = []
+        for role, title in role_titles:
+            n = len(self.servers_alive[role])
+            while n < num_servers_per_role[role]:
+                # if pending list not empty get it from there otherwise get it from generic
+                s = None
+                assert len(self.servers_alive[role + "_PENDING"]) + len(self.servers_alive[SC.ROLE_GENERIC]) > 0, "Incorrect Number of Servers" + str(num_servers_per_role)
+                if len(self.servers_alive[role + "_PENDING"]) > 0:
+                    s = self.servers_alive[role + "_PENDING"].pop()
+                else: # len(self.servers_alive[SC.ROLE_GENERIC]) > 0:
+                    s = self.servers_alive[SC.ROLE_GENERIC].pop()
+                requests.append((s, title, initialization_params_per_role[role]))
+                roles.append(role)
+                n += 1
+        # servers initialize their roles in parallel, they are recorded in the order they were picked
+        responses = self.ask_servers_concurrently(requests)
+        for role, response in zip(roles, responses):
             server_addr = response[SC.MSG_BODY]
-            print("Server ", str(server_addr), " recorded as SC.ROLE_VOTER")
-            self.servers_alive[SC.ROLE_VOTER].append(server_addr)
-        while len(self.servers_alive[SC.ROLE_SBB]) < num_servers_per_role[SC.ROLE_SBB]:
-            # if pending list not empty get it from there otherwise get it from generic
-            s = None
-            assert len(self.servers_alive[SC.ROLE_SBB + "_PENDING"]) + len(self.servers_alive[SC.ROLE_GENERIC]) > 0, "Incorrect Number of Servers" + str(num_servers_per_role)
-            if len(self.servers_alive[SC.ROLE_SBB + "_PENDING"]) > 0:
-                s = self.servers_alive[SC.ROLE_SBB + "_PENDING"].pop()
-            else: # len(self.servers_alive[SC.ROLE_GENERIC]) > 0:
-                s = self.servers_alive[SC.ROLE_GENERIC].pop()
-            ip, port = s
-            response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_ASSIGN_ROLE_SBB, body = initialization_params_per_role[SC.ROLE_SBB], origin = (SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), auth = "")
-            server_addr = response[SC.MSG_BODY]
-            print("Server ", str(server_addr), " recorded as SC.ROLE_SBB")
-            self.servers_alive[SC.ROLE_SBB].append(server_addr)
-        while len(self.servers_alive[SC.ROLE_MIX]) < num_servers_per_role[SC.ROLE_MIX]:
-            # if pending list not empty get it from there otherwise get it from generic
-            s = None
-            assert len(self.servers_alive[SC.ROLE_MIX + "_PENDING"]) + len(self.servers_alive[SC.ROLE_GENERIC]) > 0, "Incorrect Number of Servers" + str(num_servers_per_role)
-            if len(self.servers_alive[SC.ROLE_MIX + "_PENDING"]) > 0:
-                s = self.servers_alive[SC.ROLE_MIX + "_PENDING"].pop()
-            else: # len(self.servers_alive[SC.ROLE_GENERIC]) > 0:
-                s = self.servers_alive[SC.ROLE_GENERIC].pop()
-            ip, port = s
-            response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_ASSIGN_ROLE_MIX, body = initialization_params_per_role[SC.ROLE_MIX], origin = (SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), auth = "")
-            server_addr = response[SC.MSG_BODY]
-            print("Server ", str(server_addr), " recorded as SC.ROLE_MIX")
-            self.servers_alive[SC.ROLE_MIX].append(server_addr)
+            print("Server ", str(server_addr), " recorded as", role)
+            self.servers_alive[role].append(server_addr)
 
     def test_assigned_server_roles(self):
         ''' Testing assigned servers '''
@@ -90,9 +83,11 @@ class ControllerServer(socketserver.TCPServer):
         
     def broadcast_network(self):
         ''' Broadcast information about all servers to everyone '''
-        for roles in self.servers_alive:  # I can parallelize this loop
+        requests = []
+        for roles in self.servers_alive:
             for s in self.servers_alive[roles]:
-                response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_BROADCAST_ROLES, body = self.servers_alive, origin = (SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), auth = "")
+                requests.append((s, SC.MESSAGE_BROADCAST_ROLES, self.servers_alive))
+        self.ask_servers_concurrently(requests)
 
     def ask_to_produce_votes(self, election_info):
         ''' Ask voter servers to produce votes '''
@@ -113,33 +108,46 @@ class ControllerServer(socketserver.TCPServer):
             response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_PRINT_SBB, body = (public, sbb_filename), origin = (SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), auth = "")
     
     def ask_mixservers_to_mix(self):
-        ''' The ServerController abstract the phases, but it provides a counter to help with synchronization '''
+        ''' The ServerController abstract the phases, but it provides a counter to help with synchronization
+        Each phase goes at the same time to the servers that have work in it,
+        the next phase starts once all of them replied '''
         phase = 0
-        continue_flag = True
-        while continue_flag:
-            continue_flag = False
-            for s in self.servers_alive[SC.ROLE_MIX]:
-                response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_MIX, body = phase, origin = (SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), auth = "")
-                if response[SC.MSG_BODY] != "Done":
-                    continue_flag = True
+        participants = self.election.server.get_mix_phase_participants(phase)
+        while participants != None:
+            self.ask_servers_concurrently([(self.servers_alive[SC.ROLE_MIX][role_index], SC.MESSAGE_MIX, phase) for role_index in participants])
             phase += 1
+            participants = self.election.server.get_mix_phase_participants(phase)
 
     def ask_mixservers_for_proofs(self):
-        ''' The ServerController abstract the phases, but it provides a counter to help with synchronization '''
+        ''' The ServerController abstract the phases, but it provides a counter to help with synchronization
+        Each phase goes at the same time to the servers that have work in it, except for SC.PROVE_PHASES_SERIAL '''
         phase = 0
-        continue_flag = True
-        while continue_flag:
-            continue_flag = False
-            for s in self.servers_alive[SC.ROLE_MIX]:
-                response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_PROVE, body = phase, origin = (SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), auth = "")
-                if response[SC.MSG_BODY] != "Done":
-                    continue_flag = True
+        participants = self.election.server.get_prove_phase_participants(phase)
+        while participants != None:
+            servers = [self.servers_alive[SC.ROLE_MIX][role_index] for role_index in participants]
+            if phase in SC.PROVE_PHASES_SERIAL:
+                for s in servers:
+                    response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_PROVE, body = phase, origin = (SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), auth = "")
+            else:
+                self.ask_servers_concurrently([(s, SC.MESSAGE_PROVE, phase) for s in servers])
             phase += 1
+            participants = self.election.server.get_prove_phase_participants(phase)
 
     def ask_mixservers_for_tally(self):
-        for s in self.servers_alive[SC.ROLE_MIX]:
-            # only last column computes tally, only one post it to SBB
-            response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_TALLY, body = "", origin = (SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), auth = "")
+        # only last column computes tally, only one post it to SBB
+        participants = self.election.server.get_tally_participants()
+        self.ask_servers_concurrently([(self.servers_alive[SC.ROLE_MIX][role_index], SC.MESSAGE_TALLY, "") for role_index in participants])
+
+    def ask_servers_concurrently(self, requests):
+        ''' Send each (server, title, body) request in its own thread and wait until all have replied.
+        Returns the responses in the order of the requests '''
+        if self.loop is not None:
+            # asyncio runtime, await all of them on the event loop instead
+            from ServerAsync import json_client_many
+            return json_client_many(requests, origin = (SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), loop = self.loop)
+        futures = [self.executor.submit(json_client, ip = s[0], port = s[1], title = title, body = body, origin = (SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), auth = "")
+                   for (s, title, body) in requests]
+        return [future.result() for future in futures]
 
     def ask_sbb_to_close(self):
         for s in self.servers_alive[SC.ROLE_SBB]:
@@ -151,20 +159,30 @@ class ControllerServer(socketserver.TCPServer):
 
 class ControllerHandler(socketserver.BaseRequestHandler):
     '''
-    The RequestHandler class for our server. It is instantiated once per connection to the server.
+    The RequestHandler class for our server. It is instantiated once per connection to the server,
+    and serves every request sent on that connection.
     '''
     def handle(self):
         """ ServerX -> Controller [Any request]
-        Parse message and handle it depending on origin and phase.
+        Serve requests until the client closes the connection.
         """
-        request_data = parse_request_json(self.request)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            request_data = parse_request_json(self.request)
+            if request_data is None:
+                break
+            response = self.handle_request(request_data)
+            send_response_json(self.request, response, request_data[SC.MSG_ORIGIN], request_data.get(SC.MSG_ACCEPT_ENCODING))
+
+    def handle_request(self, request_data):
+        """ Parse message and handle it depending on origin and phase. """
         if request_data[SC.MSG_TITLE].startswith(SC.MESSAGE_PING_CONTROLLER_1):
             response = self.handle_provide_client_address(request_data)
         elif request_data[SC.MSG_TITLE].startswith(SC.MESSAGE_PING_CONTROLLER_2):
             response = self.handle_generic_ping(request_data)
         else:
             response = self.handle_unexpected_request(request_data)
-        send_response_json(self.request, response, request_data[SC.MSG_ORIGIN])
+        return response
 
     def handle_provide_client_address(self, request_data):
         """ Generic -> Controller [Ping]
@@ -210,32 +228,60 @@ class ControllerHandler(socketserver.BaseRequestHandler):
 
 ####################################################################################
 # TODO move code below to utils
-# TODO handle messages larger than SC.MSG_BUFFER_SIZE
 
 import sv
+import struct
+import zlib
+import lzma
+
+data_transferred_size = 0 # for debugging purposes, bytes before compression
+data_transferred_wire_size = 0 # bytes actually sent or received (after compression)
+
+# long-lived connections to other servers, keyed by their (ip, port) as in servers_alive.
+# A connection is used by one request/response at a time; concurrent callers get their own.
+connection_pool = dict()
+connection_pool_lock = threading.Lock()
+data_transferred_size_lock = threading.Lock()
 
-data_transferred_size = 0 # for debugging purposes
+# every message is sent as a fixed-size header holding its compression flags and the lengths in bytes
+# of the payload and of its binary attachment, followed by the payload itself and the attachment
+# (see SC.MSG_HEADER_FORMAT)
+MSG_HEADER_SIZE = struct.calcsize(SC.MSG_HEADER_FORMAT)
+COMPRESSION_FLAGS = {SC.COMPRESSION_ZLIB: 1, SC.COMPRESSION_LZMA: 2}
 
-def json_client(ip, port, title, origin, body = "empty body", auth = "empty auth"):
+# encodings each server accepts, keyed by (ip, port): learned from the SC.MSG_ACCEPT_ENCODING
+# of the messages they sent us, so the first messages exchanged with a server are never compressed
+peer_encodings = dict()
+
+def json_client(ip, port, title, origin, body = "empty body", auth = "empty auth", attachment = None):
     message = {SC.MSG_TITLE: title, SC.MSG_BODY: body , SC.MSG_ORIGIN: origin, SC.MSG_AUTH: auth}
-    global data_transferred_size
-    data_transferred_size += get_size(message)
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if attachment is not None:
+        message[SC.MSG_ATTACHMENT] = attachment
     if ip == "":
         ip = "127.0.0.1"
     destination_str = str([ip, port])
     print("--->" + destination_str)
     print("\t" + SC.MSG_TITLE + ": " + str(message[SC.MSG_TITLE]))
     #print("\t" + SC.MSG_BODY + ": " + str(message[SC.MSG_BODY]))
-    while True:
-        if s.connect_ex((ip, port)):
-            print("Connection Refused Error, trying again")
-            time.sleep(0.001)
-        else:
-            break
-    s.send(bytes(sv.dumps(message), SC.ENCODING_TYPE))
-    raw_response_string = recv_timeout(s)
-    # raw_response_string = s.recv(SC.MSG_BUFFER_SIZE).decode(SC.ENCODING_TYPE)
+    encoding = choose_encoding(peer_encodings.get((ip, port)))
+    s, reused = get_connection(ip, port)
+    try:
+        send_message(s, message, encoding)
+        received = recv_message(s)
+        if received is None:
+            raise ConnectionResetError("Connection closed by " + destination_str)
+    except OSError:
+        s.close()
+        if not reused:
+            raise
+        # the pooled connection went stale (peer restarted), retry once on a new one
+        s, reused = open_connection(ip, port), False
+        send_message(s, message, encoding)
+        received = recv_message(s)
+        if received is None:
+            s.close()
+            raise ConnectionResetError("Connection closed by " + destination_str)
+    raw_response_string, response_attachment = received
     #print("raw_response_string: ", raw_response_string)
     try:
         response = sv.loads(raw_response_string)
@@ -244,18 +290,52 @@ def json_client(ip, port, title, origin, body = "empty body", auth = "empty auth
         f = open('raw_response_string.txt', 'w')
         f.write(raw_response_string)
         f.close()
-    data_transferred_size += get_size(response)
+    add_attachment(response, response_attachment)
+    peer_encodings[(ip, port)] = response.get(SC.MSG_ACCEPT_ENCODING)
     print("<---" + destination_str)
     print("\t" + SC.MSG_TITLE + ": " + str(response[SC.MSG_TITLE]))
     #print("\t" + SC.MSG_BODY + ": " + str(response[SC.MSG_BODY]))
-    s.close()
+    release_connection(ip, port, s)
     if SC.DEBUG_FLAG:
-        print("data_transferred_size", data_transferred_size)
+        print("data_transferred_size", data_transferred_size, data_transferred_wire_size)
     return response
 
+def get_connection(ip, port):
+    """ Return (socket, reused) for a connection to (ip, port), taken from the pool when one is idle """
+    with connection_pool_lock:
+        idle_connections = connection_pool.get((ip, port))
+        if idle_connections:
+            return idle_connections.pop(), True
+    return open_connection(ip, port), False
+
+def release_connection(ip, port, s):
+    """ Give the connection back to the pool, so the next message to (ip, port) can reuse it """
+    with connection_pool_lock:
+        connection_pool.setdefault((ip, port), []).append(s)
+
+def open_connection(ip, port):
+    """ Connect to (ip, port), waiting for the peer to start listening if needed """
+    retry_interval = SC.CONNECT_RETRY_INTERVAL
+    while True:
+        try:
+            s = socket.create_connection((ip, port))
+            break
+        except ConnectionRefusedError:
+            print("Connection Refused Error, trying again")
+            time.sleep(retry_interval)
+            retry_interval = min(2 * retry_interval, SC.CONNECT_RETRY_INTERVAL_MAX)
+    # request/response traffic, don't let Nagle hold back the end of a message
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return s
+
 def parse_request_json(request):
-    raw_req_string = recv_timeout(request)
-    # raw_req_string = request.recv(SC.MSG_BUFFER_SIZE).decode(SC.ENCODING_TYPE)
+    """ Receive and load the next request on this connection, None once the peer closed it """
+    received = recv_message(request)
+    if received is None:
+        return None
+    return load_request(*received)
+
+def load_request(raw_req_string, attachment = None):
     try:
         request_data = sv.loads(raw_req_string) #data loaded
     except Exception as e:
@@ -263,56 +343,110 @@ def parse_request_json(request):
         f = open('raw_req_string.txt', 'w')
         f.write(raw_req_string)
         f.close()
-    global data_transferred_size
-    data_transferred_size += get_size(request_data)
+    add_attachment(request_data, attachment)
+    origin = request_data[SC.MSG_ORIGIN]
+    if isinstance(origin, list) and len(origin) == 2:
+        peer_encodings[tuple(origin)] = request_data.get(SC.MSG_ACCEPT_ENCODING)
     print("<---" + str(request_data[SC.MSG_ORIGIN]))
     print("\t" + SC.MSG_TITLE + ": " + str(request_data[SC.MSG_TITLE]))
     #print("\t" + SC.MSG_BODY + ": " + str(request_data[SC.MSG_BODY]))
     if SC.DEBUG_FLAG:
-        print("data_transferred_size", data_transferred_size)
+        print("data_transferred_size", data_transferred_size, data_transferred_wire_size)
     return request_data
 
-def send_response_json(request, response, destination):
+def send_response_json(request, response, destination, accept_encoding = None):
+    """ Send response, compressed if the request says its sender accepts it """
     print("--->" + str(destination))
     print("\t" + SC.MSG_TITLE + ": " + str(response[SC.MSG_TITLE]))
     #print("\t" + SC.MSG_BODY + ": " + str(response[SC.MSG_BODY]))
-    global data_transferred_size
-    data_transferred_size += get_size(response)
-    serialized_response = bytes(sv.dumps(response), SC.ENCODING_TYPE)
-    request.sendall(serialized_response)
+    send_message(request, response, choose_encoding(accept_encoding))
     if SC.DEBUG_FLAG:
-        print("data_transferred_size", data_transferred_size)
-
-def get_size(msg):
-    return len(sv.dumps(msg))
-
-def recv_timeout(the_socket,timeout=0.1):
-    """ Method used to allow for large data transfers"""
-    #make socket non blocking
-    the_socket.setblocking(0)
-    #total data partwise in an array
-    total_data=[];
-    data='';
-    #beginning time
-    begin=time.time()
-    while True:
-        #if you got some data, then break after timeout
-        if total_data and time.time()-begin > timeout:
-            break
-        #if you got no data at all, wait a little longer, twice the timeout
-        #elif time.time()-begin > timeout*2:
-        #    break
-        #recv something
-        try:
-            data = the_socket.recv(SC.MSG_BUFFER_SIZE).decode(SC.ENCODING_TYPE)
-            if data:
-                total_data.append(data)
-                #change the beginning time for measurement
-                begin=time.time()
-            else:
-                #sleep for sometime to indicate a gap
-                time.sleep(0.0001)
-        except:
-            pass
-    #join all parts to make final string
-    return ''.join(total_data)
\ No newline at end of file
+        print("data_transferred_size", data_transferred_size, data_transferred_wire_size)
+
+def count_data_transferred(size, wire_size):
+    """ Add size bytes to data_transferred_size and wire_size bytes to data_transferred_wire_size,
+    requests are sent and served from many threads """
+    global data_transferred_size, data_transferred_wire_size
+    with data_transferred_size_lock:
+        data_transferred_size += size
+        data_transferred_wire_size += wire_size
+
+def choose_encoding(accepted_encodings):
+    """ Return the compression to use for a server accepting accepted_encodings, None for no compression """
+    if accepted_encodings and SC.COMPRESSION in accepted_encodings:
+        return SC.COMPRESSION
+    return None
+
+def send_message(the_socket, message, encoding = None):
+    """ Serialize message and send it prefixed by its header """
+    the_socket.sendall(frame_message(message, encoding))
+
+def frame_message(message, encoding = None):
+    """ Return the bytes to send for message, its SC.MSG_ATTACHMENT (bytes) is sent after the payload.
+    Payloads of at least SC.COMPRESSION_THRESHOLD bytes are compressed with encoding (if not None),
+    attachments are binary data that is already dense and is sent as is. """
+    attachment = message.get(SC.MSG_ATTACHMENT, b'')
+    message = {key: value for key, value in message.items() if key != SC.MSG_ATTACHMENT}
+    message[SC.MSG_ACCEPT_ENCODING] = SC.ACCEPT_ENCODINGS
+    payload = bytes(sv.dumps(message), SC.ENCODING_TYPE)
+    size = len(payload) + len(attachment)
+    flags = 0
+    if encoding is not None and len(payload) >= SC.COMPRESSION_THRESHOLD:
+        flags = COMPRESSION_FLAGS[encoding]
+        payload = compress(payload, encoding)
+    count_data_transferred(size, len(payload) + len(attachment))
+    return struct.pack(SC.MSG_HEADER_FORMAT, flags, len(payload), len(attachment)) + payload + attachment
+
+def unframe_message(flags, payload, attachment):
+    """ Return (message string, attachment) from the parts received after a header with the given flags """
+    wire_size = len(payload)
+    if flags == COMPRESSION_FLAGS[SC.COMPRESSION_ZLIB]:
+        payload = zlib.decompress(payload)
+    elif flags == COMPRESSION_FLAGS[SC.COMPRESSION_LZMA]:
+        payload = lzma.decompress(payload)
+    else:
+        assert flags == 0, "Unknown message flags " + str(flags)
+    attachment_size = len(attachment) if attachment is not None else 0
+    count_data_transferred(len(payload) + attachment_size, wire_size + attachment_size)
+    # decode only once, a multi-byte character may be split between two recv calls
+    return payload.decode(SC.ENCODING_TYPE), attachment
+
+def compress(data, encoding):
+    if encoding == SC.COMPRESSION_ZLIB:
+        return zlib.compress(data, SC.COMPRESSION_LEVEL)
+    assert encoding == SC.COMPRESSION_LZMA
+    return lzma.compress(data, preset = SC.COMPRESSION_LEVEL)
+
+def add_attachment(message, attachment):
+    """ Put the attachment received with message back in it """
+    if attachment is not None:
+        message[SC.MSG_ATTACHMENT] = attachment
+
+def recv_message(the_socket):
+    """ Receive one message and return (message string, attachment bytes or None).
+    The message is complete as soon as its last byte arrives, so no idle timeout is needed.
+    Returns None if the connection is closed before a message starts. """
+    header = recv_exactly(the_socket, MSG_HEADER_SIZE)
+    if header is None:
+        return None
+    (flags, length, attachment_length) = struct.unpack(SC.MSG_HEADER_FORMAT, header)
+    payload = recv_exactly(the_socket, length)
+    assert payload is not None, "Connection closed in the middle of a message"
+    attachment = None
+    if attachment_length > 0:
+        attachment = recv_exactly(the_socket, attachment_length)
+        assert attachment is not None, "Connection closed in the middle of a message"
+    return unframe_message(flags, payload, attachment)
+
+def recv_exactly(the_socket, n):
+    """ Receive exactly n bytes into a bytearray allocated once, None if the connection is closed before the first byte """
+    data = bytearray(n)
+    view = memoryview(data)
+    received = 0
+    while received < n:
+        count = the_socket.recv_into(view[received:])
+        if count == 0:
+            assert received == 0, "Connection closed after " + str(received) + " of " + str(n) + " bytes"
+            return None
+        received += count
+    return data
@@ -1,20 +1,31 @@
 '''Generic Server'''
 import socketserver
+import socket
 import ServerConfiguration as SC##information about network
 import threading
 from ServerController import json_client
 from ServerController import parse_request_json
 from ServerController import send_response_json
+from ServerAsync import json_client_many
+from ServerAsync import json_client_stream
+from ServerAsync import start_server_thread
 import json
 import sv_election
 
-class GenericServer(socketserver.TCPServer):
-    """ Here we keep any relevant states for our server """
+class GenericServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """ Here we keep any relevant states for our server
+    Each connection is served in its own thread, since clients keep their connections open """
+    daemon_threads = True
+
     def __init__(self, server_address, RequestHandlerClass):
         socketserver.TCPServer.__init__(self, server_address, RequestHandlerClass)
         self.servers_alive = {SC.ROLE_GENERIC: [], SC.ROLE_VOTER: [], SC.ROLE_CONTROLLER: [], SC.ROLE_SBB: [], SC.ROLE_MIX: []}
         self.role = SC.ROLE_GENERIC
         self.role_index = -1
+        # requests from several servers can be served at the same time, guards the election state
+        self.lock = threading.Lock()
+        # event loop serving the requests when running the asyncio runtime (see ServerAsync.py)
+        self.loop = None
 
     def add_election_info(self, election_parameters):
         self.election = sv_election.Election(election_parameters)
@@ -29,6 +40,19 @@ class GenericServer(socketserver.TCPServer):
         for s in self.servers_alive[SC.ROLE_SBB]:
             response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_POST_TO_SBB, body = (msg_header, msg_dict, time_stamp), origin = (self.server_address[0], self.server_address[1]), auth = "")
     
+    def ask_servers(self, servers, title, body, attachment = None):
+        """ Send the same request to all servers at the same time, return their responses """
+        return json_client_many([(s, title, body) for s in servers], origin = (self.server_address[0], self.server_address[1]), loop = self.loop, attachment = attachment)
+
+    def ask_servers_streaming(self, servers, title, pieces):
+        """ Send a large request to all servers as a stream of requests, one for each (body, attachment) of pieces """
+        json_client_stream(((servers, title, body, attachment) for (body, attachment) in pieces), origin = (self.server_address[0], self.server_address[1]), loop = self.loop)
+
+    def get_stream_key_chunks(self):
+        """ Return p_list cut in chunks of SC.STREAM_CHUNK_SIZE voters, see sv.split_nested_dict """
+        p_list = self.election.p_list
+        return [p_list[start:start+SC.STREAM_CHUNK_SIZE] for start in range(0, len(p_list), SC.STREAM_CHUNK_SIZE)]
+
     def ask_sbb_hash(self, public=True):
         for s in self.servers_alive[SC.ROLE_SBB]:
             response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_HASH_SBB, body = public, origin = (self.server_address[0], self.server_address[1]), auth = "")
@@ -36,15 +60,29 @@ class GenericServer(socketserver.TCPServer):
 
 class GenericHandler(socketserver.BaseRequestHandler):
     '''
-    The RequestHandler class for our server. It is instantiated once per connection to the server.
+    The RequestHandler class for our server. It is instantiated once per connection to the server,
+    and serves every request sent on that connection.
     '''
-    
+
     def handle(self):
+        """ ServerX -> Server [Any request]
+        Serve requests until the client closes the connection.
+        """
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            request_data = parse_request_json(self.request)
+            if request_data is None:
+                break
+            # a previous request may have assigned a role to the server, use its handler from now on
+            self.__class__ = self.server.RequestHandlerClass
+            response = self.handle_request(request_data)
+            send_response_json(self.request, response, request_data[SC.MSG_ORIGIN], request_data.get(SC.MSG_ACCEPT_ENCODING))
+
+    def handle_request(self, request_data):
         """ ServerX -> Generic [Any request]
         Parse message and handle it depending on origin and phase.
         """
         print("Generic Server Handler being executed")
-        request_data = parse_request_json(self.request)
         if request_data[SC.MSG_TITLE] in [SC.MESSAGE_ASSIGN_ROLE_VOTER, SC.MESSAGE_ASSIGN_ROLE_SBB, SC.MESSAGE_ASSIGN_ROLE_MIX]:
             response = self.handle_assign_role(request_data)
         elif request_data[SC.MSG_TITLE] == SC.MESSAGE_GET_ROLE:
@@ -53,7 +91,7 @@ class GenericHandler(socketserver.BaseRequestHandler):
             response = self.handle_get_network_information(request_data)
         else:
             response = self.handle_unexpected_request(request_data)
-        send_response_json(self.request, response, request_data[SC.MSG_ORIGIN])
+        return response
 
     def get_incomplete_response(self, title):
         response = {}
@@ -70,6 +108,7 @@ class GenericHandler(socketserver.BaseRequestHandler):
         """
         server_addr = ("","")
         initialization_param = request_data[SC.MSG_BODY]
+        # the server keeps serving its connections, the next requests go to the handler of its new role
         if request_data[SC.MSG_TITLE] == SC.MESSAGE_ASSIGN_ROLE_VOTER:
             from ServerVoter import VoterHandler
             from ServerVoter import VoterServer
@@ -77,13 +116,8 @@ class GenericHandler(socketserver.BaseRequestHandler):
             self.server.__class__ = VoterServer
             self.server.RequestHandlerClass = VoterHandler
             self.server.add_election_info(initialization_param)
-            voter_server = self.server
-            voter_server_addr = self.server.server_address
-            #voter_server, voter_server_addr = getTCPSocketServer(Handler = VoterHandler, ServerConstructor = VoterServer, addr = self.server.server_address ,initialization_param = initialization_param)
-            voter_server_t = threading.Thread(target=voter_server.serve_forever, daemon = True)
-            voter_server.role = SC.ROLE_VOTER
-            voter_server_t.start()
-            server_addr = voter_server_addr
+            self.server.role = SC.ROLE_VOTER
+            server_addr = self.server.server_address
         elif request_data[SC.MSG_TITLE] == SC.MESSAGE_ASSIGN_ROLE_SBB:
             from ServerSBB import SBBHandler
             from ServerSBB import SBBServer
@@ -92,13 +126,8 @@ class GenericHandler(socketserver.BaseRequestHandler):
             self.server.RequestHandlerClass = SBBHandler
             self.server.add_election_info(initialization_param)
             self.server.create_sbb(self.server.election.election_id)
-            sbb_server = self.server
-            sbb_server_addr = self.server.server_address
-            #sbb_server, sbb_server_addr = getTCPSocketServer(Handler = SBBHandler, ServerConstructor = SBBServer, addr = self.server.server_address ,initialization_param = initialization_param)
-            sbb_server_t = threading.Thread(target=sbb_server.serve_forever, daemon = True)
-            sbb_server.role = SC.ROLE_SBB
-            sbb_server_t.start()
-            server_addr = sbb_server_addr
+            self.server.role = SC.ROLE_SBB
+            server_addr = self.server.server_address
         elif request_data[SC.MSG_TITLE] == SC.MESSAGE_ASSIGN_ROLE_MIX:
             from ServerMix import MixHandler
             from ServerMix import MixServer
@@ -106,13 +135,8 @@ class GenericHandler(socketserver.BaseRequestHandler):
             self.server.__class__ = MixServer
             self.server.RequestHandlerClass = MixHandler
             self.server.add_election_info(initialization_param)
-            mix_server = self.server
-            mix_server_addr = self.server.server_address
-            #mix_server, mix_server_addr = getTCPSocketServer(Handler = MixHandler, ServerConstructor = MixServer, addr = self.server.server_address ,initialization_param = initialization_param)
-            mix_server_t = threading.Thread(target=mix_server.serve_forever, daemon = True)
-            mix_server.role = SC.ROLE_MIX
-            mix_server_t.start()
-            server_addr = mix_server_addr
+            self.server.role = SC.ROLE_MIX
+            server_addr = self.server.server_address
         response = self.get_incomplete_response(request_data[SC.MSG_TITLE])
         response[SC.MSG_BODY] = server_addr
         return response
@@ -175,7 +199,5 @@ if __name__ == "__main__":
     response = json_client(ip = SC.CONTROLLER_HOST, port = SC.CONTROLLER_PORT, title = SC.MESSAGE_PING_CONTROLLER_2, body = "", origin = server_addr, auth = "")
     # Activate the server; this will keep running until you
     # interrupt the program with Ctrl-C
-    server_thread = threading.Thread(target=server.serve_forever, daemon = True)
-    #daemon threads allow us to finish the program execution, even though some threads may be running
-    server_thread.start()
+    server_thread = start_server_thread(server)
     stop = input("Stop?")
\ No newline at end of file
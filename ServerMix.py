@@ -2,15 +2,16 @@
 from ServerGeneric import GenericHandler
 from ServerGeneric import GenericServer
 from ServerGeneric import getTCPSocketServer
+from ServerAsync import start_server_thread
+from ServerAsync import json_client_many
 import ServerConfiguration as SC##information about network
 import threading
 from ServerController import json_client
-from ServerController import parse_request_json
-from ServerController import send_response_json
 import json
 import sv_election
 import sv_tally
 import sv_prover
+import sv_codec
 import sv
 
 " ids for MixServers are based on the position in the broadcasted network list"
@@ -21,16 +22,106 @@ class MixServer(GenericServer):
         # self.sbb_hash = None
         # self.challenges = None
 
+    def add_election_info(self, election_parameters):
+        GenericServer.add_election_info(self, election_parameters)
+        # notified after each sdb update, when mixing waits for its inputs (SC.MIX_PIPELINED)
+        self.sdb_updated = threading.Condition(self.lock)
+
+    def share_sdb_update(self, servers, dict_update):
+        """ Stream dict_update to the servers, encoded as selected by SC.SDB_CODEC """
+        if len(servers) == 0:
+            return
+        pieces = sv.split_nested_dict(dict_update, self.get_stream_key_chunks())
+        self.ask_servers_streaming(servers, SC.MESSAGE_UPDATE_SDB_DATABASE, (self.encode_sdb_update(piece) for piece in pieces))
+
+    def encode_sdb_update(self, dict_update):
+        """ Return (body, attachment) of a request carrying dict_update """
+        if SC.SDB_CODEC == SC.SDB_CODEC_BINARY:
+            return sv_codec.encode_sdb_update(self.election, dict_update)
+        return dict_update, None
+
+    def decode_sdb_update(self, body, attachment):
+        """ Return the dict update carried by a request (see encode_sdb_update) """
+        if attachment is not None:
+            return sv_codec.decode_sdb_update(self.election, body, attachment)
+        # permutations arrive as dicts in json
+        return sv.normalize_permutations(body, self.election.p_list)
+
+    def fetch_sdb(self, requests):
+        """ Fetch sdb entries from other Mix servers and merge them into sdb.
+        requests is a list of (server, paths), with paths a list of [race_id, i, j, k, name] """
+        # each server streams the entries back as sdb updates (see handle_fetch_sdb), and only responds
+        # once they have all been merged
+        json_client_many([(s, SC.MESSAGE_FETCH_SDB, paths) for (s, paths) in requests],
+                         origin = (self.server_address[0], self.server_address[1]), loop = self.loop)
+
+    def fetch_outputs(self, row_index, k_list):
+        """ Fetch the last-column y's of passes k_list from threshold-1 other rows (SC.FETCH_OUTPUTS),
+        return the rows whose y's are now known, row_index first """
+        election_server = self.election.server
+        cols = election_server.cols
+        rows = [row_index] + [i for i in election_server.row_list if i != row_index][:election_server.threshold-1]
+        requests = []
+        for i in rows[1:]:
+            s = self.servers_alive[SC.ROLE_MIX][election_server.get_server_index(i, cols-1)]
+            requests.append((s, [[race_id, i, cols-1, k, 'y'] for race_id in self.election.race_ids for k in k_list]))
+        self.fetch_sdb(requests)
+        return rows
+
+    def get_mix_targets(self, row_index, col_index):
+        """ Return the servers that receive the passes mixed by server (row_index, col_index):
+        the next server in the row, or for the last column the other servers in the column """
+        election_server = self.election.server
+        if col_index < election_server.cols - 1:
+            target_role_indices = [election_server.get_server_index(row_index, col_index+1)]
+        elif SC.FETCH_OUTPUTS: # fetched when needed, see fetch_outputs
+            target_role_indices = []
+        else:
+            # TODO this should happen only for k in opl -> move this to tally phase
+            target_role_indices = [election_server.get_server_index(target_row, col_index)
+                                   for target_row in election_server.row_list if target_row != row_index]
+        return [self.servers_alive[SC.ROLE_MIX][target_role_idx] for target_role_idx in target_role_indices]
+
+    def wait_for_mix_inputs(self, row_index, col_index, passes):
+        """ Block until the x's of at least one of the (race_id, k) passes have all arrived
+        from the previous column, return the passes whose x's have all arrived """
+        n = len(self.election.p_list)
+        def ready_passes():
+            sdb = self.election.server.sdb
+            return [(race_id, k) for (race_id, k) in passes
+                    if len(sdb[race_id][row_index][col_index][k]['x']) == n]
+        with self.sdb_updated:
+            self.sdb_updated.wait_for(ready_passes)
+            return ready_passes()
+
+    def mix_pipelined(self, row_index, col_index):
+        """ Mix the passes of server (row_index, col_index) as soon as their inputs are there,
+        forwarding each batch of mixed passes right away (SC.MIX_PIPELINED) """
+        election = self.election
+        targets = self.get_mix_targets(row_index, col_index)
+        # a batch feeds all the workers when mixing in worker processes
+        batch_size = SC.WORKER_PROCESSES if SC.PARALLEL_MIXING else 1
+        remaining = [(race_id, k) for race_id in election.race_ids for k in election.k_list]
+        while remaining:
+            if col_index == 0: # inputs were replicated in phase 1
+                ready = remaining
+            else:
+                ready = self.wait_for_mix_inputs(row_index, col_index, remaining)
+            batch = ready[:max(1, batch_size)]
+            dict_update_to_share = election.server.mix_phase_process_left_to_right(row_index, col_index, batch)
+            self.share_sdb_update(targets, dict_update_to_share)
+            remaining = [unit for unit in remaining if unit not in batch]
+
 class MixHandler(GenericHandler):
     '''
-    The RequestHandler class for our server. It is instantiated once per connection to the server.    
+    The RequestHandler class for our server. It is instantiated once per connection to the server,
+    requests are read in GenericHandler.handle.
     '''
     
-    def handle(self):
+    def handle_request(self, request_data):
         """ ServerX -> Controller [Any request]
         Parse message and handle it depending on origin and phase.
         """
-        request_data = parse_request_json(self.request)
         response = None
         if request_data[SC.MSG_TITLE] == SC.MESSAGE_GET_ROLE:
             response = self.handle_get_role(request_data)
@@ -46,9 +137,11 @@ class MixHandler(GenericHandler):
             response = self.handle_prove(request_data)
         elif request_data[SC.MSG_TITLE] == SC.MESSAGE_UPDATE_SDB_DATABASE:
             response = self.handle_update_sdb(request_data)
+        elif request_data[SC.MSG_TITLE] == SC.MESSAGE_FETCH_SDB:
+            response = self.handle_fetch_sdb(request_data)
         else:
-            response = self.handle_unexpected_request()
-        send_response_json(self.request, response, request_data[SC.MSG_ORIGIN])
+            response = self.handle_unexpected_request(request_data)
+        return response
 
     def handle_get_split_value_votes(self, request_data):
         """ Voter -> Mix [Distribute Votes]
@@ -57,9 +150,8 @@ class MixHandler(GenericHandler):
         Output: Done """
         response = self.get_incomplete_response(request_data[SC.MSG_TITLE])
         (race_id, i, sdbp) = request_data[SC.MSG_BODY]
-        self.server.election.server.sdb[race_id][i][0] = sdbp
-        if self.server.role_index == self.server.election.server.get_server_index(i,0):
-            self.server.election.server.sdb[race_id][i][0] = sdbp
+        with self.server.lock: # votes are streamed, sdbp holds the part of them in this request
+            sv.update_nested_dict(self.server.election.server.sdb[race_id][i][0], sdbp)
         response[SC.MSG_BODY] = "Done"
         return response
 
@@ -90,11 +182,16 @@ class MixHandler(GenericHandler):
                         continue
                     target_role_idx = self.server.election.server.get_server_index(target_row, col_index)
                     target_servers.append(self.server.servers_alive[SC.ROLE_MIX][target_role_idx])
-                for s in target_servers:
-                    response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_UPDATE_SDB_DATABASE, body = dict_update_to_share, origin = (self.server.server_address[0], self.server.server_address[1]), auth = "")
+                self.server.share_sdb_update(target_servers, dict_update_to_share)
+                if SC.FUZZ_SEEDS: # each row gets only the keys of its own obfuscation values
+                    for target_row, target_server in zip(self.server.election.server.row_list[1:], target_servers):
+                        dict_update_to_share = self.server.election.server.mix_phase_fuzz_seeds(row_index, col_index, target_row)
+                        self.server.share_sdb_update([target_server], dict_update_to_share)
             response[SC.MSG_BODY] = "phase "+ str(phase) + " completed for role_index " + str(role_index)
         elif phase == 3:
-            if row_index == 'a': # only first row is enough and info is propagated each column
+            if SC.PERMUTATION_SEEDS or SC.FUZZ_SEEDS: # seeds were received in phase 2
+                self.server.election.server.mix_phase_values_from_seeds(row_index, col_index)
+            if row_index == 'a' and not SC.FUZZ_SEEDS: # only first row is enough and info is propagated each column
                 dict_update_to_share = self.server.election.server.mix_phase_generate_obfuscation_values(row_index, col_index)
                 target_servers = [] # propagating updates to serves in the same column
                 for target_row in self.server.election.server.row_list:
@@ -102,26 +199,17 @@ class MixHandler(GenericHandler):
                         continue
                     target_role_idx = self.server.election.server.get_server_index(target_row, col_index)
                     target_servers.append(self.server.servers_alive[SC.ROLE_MIX][target_role_idx])
-                for s in target_servers:
-                    response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_UPDATE_SDB_DATABASE, body = dict_update_to_share, origin = (self.server.server_address[0], self.server.server_address[1]), auth = "")
+                self.server.share_sdb_update(target_servers, dict_update_to_share)
+            response[SC.MSG_BODY] = "phase "+ str(phase) + " completed for role_index " + str(role_index)
+        elif phase == 4 and SC.MIX_PIPELINED:
+            # all columns at once, each pass is forwarded as soon as it is mixed
+            self.server.mix_pipelined(row_index, col_index)
             response[SC.MSG_BODY] = "phase "+ str(phase) + " completed for role_index " + str(role_index)
         elif phase > 3 and phase <= 3+num_columns:
             # get it on (i,j) forward it to (i,j+1), first process all 1st column, when ready, all 2nd column
-            if col_index == phase-4 and col_index != num_columns-1: # one column at a time, data is propagated left-to-right
+            if col_index == phase-4: # one column at a time, data is propagated left-to-right
                 dict_update_to_share = self.server.election.server.mix_phase_process_left_to_right(row_index, col_index)
-                target_role_idx = self.server.election.server.get_server_index(row_index, col_index+1)
-                s = self.server.servers_alive[SC.ROLE_MIX][target_role_idx]
-                response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_UPDATE_SDB_DATABASE, body = dict_update_to_share, origin = (self.server.server_address[0], self.server.server_address[1]), auth = "")
-            elif col_index == phase-4 and col_index == num_columns-1: # one column at a time, data is propagated left-to-right
-                dict_update_to_share = self.server.election.server.mix_phase_process_left_to_right(row_index, col_index)
-                target_servers = []
-                for target_row in self.server.election.server.row_list:
-                    if target_row == row_index:
-                        continue
-                    target_role_idx = self.server.election.server.get_server_index(target_row, col_index)
-                    target_servers.append(self.server.servers_alive[SC.ROLE_MIX][target_role_idx])
-                for s in target_servers: # TODO this should happen only for k in opl -> move this to tally phase
-                    response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_UPDATE_SDB_DATABASE, body = dict_update_to_share, origin = (self.server.server_address[0], self.server.server_address[1]), auth = "")
+                self.server.share_sdb_update(self.server.get_mix_targets(row_index, col_index), dict_update_to_share)
             response[SC.MSG_BODY] = "phase "+ str(phase) + " completed for role_index " + str(role_index)
         else:
             response[SC.MSG_BODY] = "Done"
@@ -158,10 +246,9 @@ class MixHandler(GenericHandler):
             response[SC.MSG_BODY] = "phase "+ str(phase) + " completed for role_index " + str(role_index)
         elif phase == 2:
             dict_update_to_share = sv_prover.share_icl_pik_dict(election, election.server.challenges, row_index, col_index)
-            for s in self.server.servers_alive[SC.ROLE_MIX]:
-                if s[0] == self.server.server_address[0] and s[1] == self.server.server_address[1]:
-                    continue # skips itself
-                response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_UPDATE_SDB_DATABASE, body = dict_update_to_share, origin = (self.server.server_address[0], self.server.server_address[1]), auth = "")
+            target_servers = [s for s in self.server.servers_alive[SC.ROLE_MIX] # skips itself
+                              if s[0] != self.server.server_address[0] or s[1] != self.server.server_address[1]]
+            self.server.share_sdb_update(target_servers, dict_update_to_share)
             response[SC.MSG_BODY] = "phase "+ str(phase) + " completed for role_index " + str(role_index)
         elif phase == 3:
             msg_header, msg_dict = sv_prover.compute_and_post_pik_dict(election, election.server.challenges, row_index, col_index)
@@ -173,7 +260,7 @@ class MixHandler(GenericHandler):
                 dict_update_to_share = sv_prover.share_icl_ux_uy_dict(election, election.server.challenges, row_index, col_index)
                 target_role_idx = self.server.election.server.get_server_index(row_index, cols-1)
                 s = self.server.servers_alive[SC.ROLE_MIX][target_role_idx] # sensitive information only share it with server in same row, last column
-                response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_UPDATE_SDB_DATABASE, body = dict_update_to_share, origin = (self.server.server_address[0], self.server.server_address[1]), auth = "")
+                self.server.share_sdb_update([s], dict_update_to_share)
             response[SC.MSG_BODY] = "phase "+ str(phase) + " completed for role_index " + str(role_index)
         elif phase == 5:
             if col_index == cols-1:
@@ -219,7 +306,13 @@ class MixHandler(GenericHandler):
         num_columns = self.server.election.server.cols
         response = self.get_incomplete_response(request_data[SC.MSG_TITLE])
         if col_index == num_columns-1:
-            msg_header, msg_dict = sv_tally.compute_tally(self.server.election)
+            if SC.FETCH_OUTPUTS:
+                # only the output production passes are needed
+                k_list = self.server.election.server.challenges['cut']['opl']
+                row_list = self.server.fetch_outputs(row_index, k_list)
+                msg_header, msg_dict = sv_tally.compute_tally(self.server.election, k_list, row_list)
+            else:
+                msg_header, msg_dict = sv_tally.compute_tally(self.server.election)
             sv_tally.print_tally(self.server.election)
             if row_index == 'a': # only one server sends tally to SBB
                 # Save tallies to sbb.
@@ -233,8 +326,26 @@ class MixHandler(GenericHandler):
         Action: update sdb
         Output: Done """
         response = self.get_incomplete_response(request_data[SC.MSG_TITLE])
-        dict_update = request_data[SC.MSG_BODY]
-        self.server.election.server.sdb = sv.update_nested_dict(self.server.election.server.sdb, dict_update)
+        dict_update = self.server.decode_sdb_update(request_data[SC.MSG_BODY], request_data.get(SC.MSG_ATTACHMENT))
+        with self.server.sdb_updated: # several servers may send their updates at the same time
+            self.server.election.server.sdb = sv.update_nested_dict(self.server.election.server.sdb, dict_update)
+            self.server.sdb_updated.notify_all()
+        response[SC.MSG_BODY] = "Done"
+        return response
+
+    def handle_fetch_sdb(self, request_data):
+        """ Mix -> Mix
+        Input: list of [race_id, i, j, k, name] paths
+        Action: stream the sdb entries at those paths to the requesting server, as sdb updates
+        Output: Done """
+        response = self.get_incomplete_response(request_data[SC.MSG_TITLE])
+        dict_update = dict()
+        with self.server.lock:
+            sdb = self.server.election.server.sdb
+            for race_id, i, j, k, name in request_data[SC.MSG_BODY]:
+                dict_update.setdefault(race_id, {}).setdefault(i, {}).setdefault(j, {}).setdefault(k, {})[name] = \
+                    sdb[race_id][i][j][k][name]
+        self.server.share_sdb_update([request_data[SC.MSG_ORIGIN]], dict_update)
         response[SC.MSG_BODY] = "Done"
         return response
 
@@ -247,7 +358,5 @@ if __name__ == "__main__":
     response = json_client(ip = SC.CONTROLLER_HOST, port = SC.CONTROLLER_PORT, title = SC.MESSAGE_PING_CONTROLLER_2, body = SC.ROLE_MIX, origin = server_addr, auth = "")
     # Activate the server; this will keep running until you
     # interrupt the program with Ctrl-C
-    server_thread = threading.Thread(target=server.serve_forever, daemon = True)
-    #daemon threads allow us to finish the program execution, even though some threads may be running
-    server_thread.start()
-    stop = input("Stop?")
\ No newline at end of file
+    server_thread = start_server_thread(server)
+    stop = input("Stop?")
@@ -2,11 +2,9 @@
 from ServerGeneric import GenericHandler
 from ServerGeneric import GenericServer
 from ServerGeneric import getTCPSocketServer
+from ServerAsync import start_server_thread
 import ServerConfiguration as SC##information about network
-import threading
 from ServerController import json_client
-from ServerController import parse_request_json
-from ServerController import send_response_json
 import json
 import sv_sbb
 import sv_election
@@ -37,14 +35,14 @@ class SBBServer(GenericServer):
 
 class SBBHandler(GenericHandler):
     '''
-    The RequestHandler class for our server. It is instantiated once per connection to the server.    
+    The RequestHandler class for our server. It is instantiated once per connection to the server,
+    requests are read in GenericHandler.handle.
     '''
     
-    def handle(self):
+    def handle_request(self, request_data):
         """ ServerX -> Controller [Any request]
         Parse message and handle it depending on origin and phase.
         """
-        request_data = parse_request_json(self.request)
         response = None
         if request_data[SC.MSG_TITLE] == SC.MESSAGE_GET_ROLE:
             response = self.handle_get_role(request_data)
@@ -61,8 +59,8 @@ class SBBHandler(GenericHandler):
         elif request_data[SC.MSG_TITLE] == SC.MESSAGE_VERIFY:
             response = self.handle_verify_sbb(request_data)
         else:
-            response = self.handle_unexpected_request()
-        send_response_json(self.request, response, request_data[SC.MSG_ORIGIN])
+            response = self.handle_unexpected_request(request_data)
+        return response
 
     def handle_post(self, request_data):
         """ServerX -> SBB[Post Y]
@@ -72,7 +70,8 @@ class SBBHandler(GenericHandler):
         msg_header, msg_dict, time_stamp = request_data[SC.MSG_BODY]
         print("POSTING ", request_data[SC.MSG_TITLE])
         #print("POSTING ", request_data)
-        self.server.sbb.post(msg_header, msg_dict, time_stamp)
+        with self.server.lock: # servers of the same phase post at the same time
+            self.server.sbb.post(msg_header, msg_dict, time_stamp)
         response = self.get_incomplete_response(request_data[SC.MSG_TITLE])
         response[SC.MSG_BODY] = "Done"
         return response
@@ -84,7 +83,8 @@ class SBBHandler(GenericHandler):
         Output: Done"""
         public, sbb_filename = request_data[SC.MSG_BODY]
         print("PRINTING ", request_data)
-        self.server.sbb.print_sbb(public, sbb_filename)
+        with self.server.lock:
+            self.server.sbb.print_sbb(public, sbb_filename)
         response = self.get_incomplete_response(request_data[SC.MSG_TITLE])
         response[SC.MSG_BODY] = "Done"
         return response
@@ -95,7 +95,8 @@ class SBBHandler(GenericHandler):
         Action: Compute hash of SBB
         Output: sbb_hash"""
         public = request_data[SC.MSG_BODY]
-        sbb_hash = self.server.sbb.hash_sbb(public)
+        with self.server.lock:
+            sbb_hash = self.server.sbb.hash_sbb(public)
         response = self.get_incomplete_response(request_data[SC.MSG_TITLE])
         response[SC.MSG_BODY] = sv.bytes2hex(sbb_hash)
         print ("response[SC.MSG_BODY]/hash: ", response[SC.MSG_BODY])
@@ -106,7 +107,8 @@ class SBBHandler(GenericHandler):
         Input: Request to close SBB
         Action: Close SBB (set flag)
         Output: Done"""
-        self.server.sbb.close()
+        with self.server.lock:
+            self.server.sbb.close()
         response = self.get_incomplete_response(request_data[SC.MSG_TITLE])
         response[SC.MSG_BODY] = "Done"
         return response
@@ -132,7 +134,5 @@ if __name__ == "__main__":
     response = json_client(ip = SC.CONTROLLER_HOST, port = SC.CONTROLLER_PORT, title = SC.MESSAGE_PING_CONTROLLER_2, body = SC.ROLE_SBB, origin = server_addr, auth = "")
     # Activate the server; this will keep running until you
     # interrupt the program with Ctrl-C
-    server_thread = threading.Thread(target=server.serve_forever, daemon = True)
-    #daemon threads allow us to finish the program execution, even though some threads may be running
-    server_thread.start()
+    server_thread = start_server_thread(server)
     stop = input("Stop?")
\ No newline at end of file
@@ -2,13 +2,12 @@
 from ServerGeneric import GenericHandler
 from ServerGeneric import GenericServer
 from ServerGeneric import getTCPSocketServer
+from ServerAsync import start_server_thread
 import ServerConfiguration as SC##information about network
-import threading
 from ServerController import json_client
-from ServerController import parse_request_json
-from ServerController import send_response_json
 import json
 import sv_election
+import sv
 
 class VoterServer(GenericServer):
     # TODO election logic should be moved to other files like Voter.py
@@ -56,8 +55,8 @@ class VoterServer(GenericServer):
         for race_id in self.election.race_ids:
             for i in self.election.server.row_list:
                 sdbp = self.election.server.sdb[race_id][i][0]
-                for s in self.servers_alive[SC.ROLE_MIX]:
-                    response = json_client(ip = s[0], port = s[1], title = SC.MESSAGE_SPLIT_VALUE_VOTES, body = (race_id, i, sdbp), origin = (self.server_address[0], self.server_address[1]), auth = "")
+                pieces = sv.split_nested_dict(sdbp, self.get_stream_key_chunks())
+                self.ask_servers_streaming(self.servers_alive[SC.ROLE_MIX], SC.MESSAGE_SPLIT_VALUE_VOTES, (((race_id, i, piece), None) for piece in pieces))
 
     def post_cast_vote_commitments(self):
         """ Post cast vote commitments onto SBB. """
@@ -79,14 +78,14 @@ class VoterServer(GenericServer):
 
 class VoterHandler(GenericHandler):
     '''
-    The RequestHandler class for our server. It is instantiated once per connection to the server.    
+    The RequestHandler class for our server. It is instantiated once per connection to the server,
+    requests are read in GenericHandler.handle.
     '''
 
-    def handle(self):
+    def handle_request(self, request_data):
         """ ServerX -> Controller [Any request]
         Parse message and handle it depending on origin and phase.
         """
-        request_data = parse_request_json(self.request)
         response = None
         if request_data[SC.MSG_TITLE] == SC.MESSAGE_GET_ROLE:
             response = self.handle_get_role(request_data)
@@ -97,8 +96,8 @@ class VoterHandler(GenericHandler):
         elif request_data[SC.MSG_TITLE] == SC.MESSAGE_DISTRIBUTE_VOTES:
             response = self.handle_distribute_votes(request_data)
         else:
-            response = self.handle_unexpected_request()
-        send_response_json(self.request, response, request_data[SC.MSG_ORIGIN])
+            response = self.handle_unexpected_request(request_data)
+        return response
 
     def handle_produce_votes(self, request_data):
         """ Controller -> Voter [Produce Votes]
@@ -131,7 +130,5 @@ if __name__ == "__main__":
     response = json_client(ip = SC.CONTROLLER_HOST, port = SC.CONTROLLER_PORT, title = SC.MESSAGE_PING_CONTROLLER_2, body = SC.ROLE_VOTER, origin = server_addr, auth = "")
     # Activate the server; this will keep running until you
     # interrupt the program with Ctrl-C
-    server_thread = threading.Thread(target=server.serve_forever, daemon = True)
-    #daemon threads allow us to finish the program execution, even though some threads may be running
-    server_thread.start()
+    server_thread = start_server_thread(server)
     stop = input("Stop?")
\ No newline at end of file
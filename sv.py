@@ -11,11 +11,15 @@
 # MIT open-source license.
 # (See https://github.com/ron-rivest/split-value-voting.git)
 
+from array import array
 import base64
 import hmac
 import hashlib
+import os
 import sys
 
+import sv_vector
+
 ##############################################################################
 # Security parameters (key lengths)
 ##############################################################################
@@ -87,12 +91,7 @@ def bytes2hex(x):
     Could also use binascii.hexlify(x)
     """
     assert isinstance(x, (bytes, bytearray))
-    ans = []
-    hexdigits = "0123456789abcdef"
-    for c in x:
-        ans.append(hexdigits[c >> 4])
-        ans.append(hexdigits[c & 0xf])
-    return "".join(ans)
+    return x.hex()
 
 def hex2bytes(s):
     """ Return bytes representation of hex string s. """
@@ -106,10 +105,7 @@ def bytes2int(x):
     First byte in sequence is least-significant byte.
     """
     assert isinstance(x, (bytes, bytearray))
-    ans = 0
-    for i in range(len(x)-1, -1, -1):
-        ans = 256*ans + x[i]
-    return ans
+    return int.from_bytes(x, 'little')
 
 def int2bytes(x, desired_length=None):
     """ Return bytes representation of integer x >= 0 of desired length.
@@ -121,19 +117,10 @@ def int2bytes(x, desired_length=None):
     assert not desired_length or \
         (isinstance(desired_length, int) and desired_length > 0)
 
-    byte_list = []
     if not desired_length:
-        if x == 0:
-            return b"\x00"
-        while x > 0:
-            byte_list.append(x % 256)
-            x = x // 256
-    else:
-        while len(byte_list) < desired_length:
-            byte_list.append(x % 256)
-            x = x // 256
-    assert not desired_length or len(byte_list) == desired_length
-    return bytes(byte_list)
+        return x.to_bytes(max(1, (x.bit_length() + 7) // 8), 'little')
+    # high-order bytes beyond desired_length are dropped
+    return (x % 256**desired_length).to_bytes(desired_length, 'little')
 
 def bytes2base64(x):
     """ Convert bytes value x to base64 representation as a string. """
@@ -151,8 +138,6 @@ def test_conversions():
     x = b"012345abcde"
     assert base64_2_bytes(bytes2base64(x)) == x
 
-test_conversions()
-
 ##############################################################################
 # RANDOMNESS
 ##############################################################################
@@ -219,7 +204,91 @@ def test_random():
     # print(ans)
     assert ans == 74
 
-test_random()
+# get_random_many_from_source produces its values in one of two ways:
+RANDOM_STREAM_COMPAT = "compat"     # same values as that many calls to get_random_from_source
+RANDOM_STREAM_COUNTER = "counter"   # value i is hash of (seed, i), one hash per value instead of three
+RANDOM_STREAM_MODE = RANDOM_STREAM_COMPAT
+
+def get_random_many_from_source(rand_name, count, modulus=None):
+    """ Return list of next count random values for given randomness source.
+
+    Values are as for get_random_from_source (bytes, or integers modulo
+    modulus if modulus is given). With RANDOM_STREAM_MODE == RANDOM_STREAM_COMPAT
+    they are exactly the values that count calls to get_random_from_source
+    would return; with RANDOM_STREAM_COUNTER they are computed in counter
+    mode from the current seed, which then advances by one hash.
+    """
+    assert rand_name in randomness_sources
+    assert isinstance(count, int) and count >= 0
+    assert not modulus or (isinstance(modulus, int) and modulus > 0)
+    sha256 = hashlib.sha256
+    seed = randomness_sources[rand_name]
+    if RANDOM_STREAM_MODE == RANDOM_STREAM_COUNTER:
+        random_outputs = [sha256(seed + b"get_random_many" + i.to_bytes(8, 'little')).digest()
+                          for i in range(count)]
+        seed = sha256(seed + b"get_random_many:next_seed").digest()
+    else:
+        assert RANDOM_STREAM_MODE == RANDOM_STREAM_COMPAT
+        random_outputs = []
+        for _ in range(count):
+            # as in get_random_from_source: next seed, then tweaked hash of it
+            seed = sha256(seed).digest()
+            random_outputs.append(sha256(b"get_random" + sha256(seed).digest().hex().encode()).digest())
+    randomness_sources[rand_name] = seed
+    if modulus == None:
+        return random_outputs
+    return [int.from_bytes(random_output, 'little') % modulus
+            for random_output in random_outputs]
+
+def test_random_many():
+    """ Test get_random_many_from_source in both modes. """
+    global RANDOM_STREAM_MODE
+    mode = RANDOM_STREAM_MODE
+    try:
+        RANDOM_STREAM_MODE = RANDOM_STREAM_COMPAT
+        init_randomness_source("spam")
+        singles = [get_random_from_source("spam", 1000) for _ in range(6)]
+        init_randomness_source("spam")
+        assert get_random_many_from_source("spam", 5, 1000) == singles[:5]
+        assert get_random_from_source("spam", 1000) == singles[5]
+        RANDOM_STREAM_MODE = RANDOM_STREAM_COUNTER
+        init_randomness_source("spam")
+        values = get_random_many_from_source("spam", 5)
+        init_randomness_source("spam")
+        assert get_random_many_from_source("spam", 2) == values[:2]
+        assert get_random_many_from_source("spam", 5) != values
+        assert len(set(values)) == 5
+    finally:
+        RANDOM_STREAM_MODE = mode
+
+def split_randomness_source(rand_name, label):
+    """ Derive a child randomness source from rand_name and label; return its name.
+
+    The child's seed depends only on the current seed of rand_name and on
+    label, and rand_name itself is not advanced.  So children with distinct
+    labels are independent streams that can be consumed in any order, or in
+    other processes (see init_randomness_source with an initial_seed),
+    and still give the same values.
+    """
+    assert rand_name in randomness_sources
+    label = str(label)
+    child_name = rand_name + "/" + label
+    randomness_sources[child_name] = \
+        secure_hash(randomness_sources[rand_name], "split:" + label)
+    return child_name
+
+def test_split_randomness_source():
+    """ Test split_randomness_source. """
+    init_randomness_source("spam")
+    parent = randomness_sources["spam"]
+    first = split_randomness_source("spam", "A")
+    split_randomness_source("spam", "B")
+    assert randomness_sources["spam"] == parent
+    a = get_random_many_from_source(first, 3)
+    b = get_random_many_from_source(split_randomness_source("spam", "B"), 3)
+    assert a != b
+    # child values do not depend on the order the children are consumed in
+    assert get_random_many_from_source(split_randomness_source("spam", "A"), 3) == a
 
 ##############################################################################
 # GENERATE A RANDOM PERMUTATION
@@ -227,29 +296,30 @@ test_random()
 
 def random_permutation(elts, rand_name):
     """
-    Generate and return a random permutation (as a dict) of given set of
-    elements using random source with name rand_name.  If elts is an integer,
-    it is interpreted as range(elts)
+    Generate and return a random permutation (as a Permutation) of given set
+    of elements using random source with name rand_name.  If elts is an
+    integer, it is interpreted as range(elts)
 
     Use Fisher-Yates method.
     """
     if isinstance(elts, int):
         elts = range(elts)
-    elts = list(elts)
+    if not isinstance(elts, (list, range)):
+        elts = list(elts)
     g = len(elts)
     pi = list(range(g))
+    random_outputs = get_random_many_from_source(rand_name, max(0, g-1))
     for i in range(1, g):
-        j = get_random_from_source(rand_name, i+1)
+        j = bytes2int(random_outputs[i-1]) % (i+1)
         temp = pi[i]
         pi[i] = pi[j]
         pi[j] = temp
-    perm = dict()
-    for i in range(g):
-        perm[elts[i]] = elts[pi[i]]
-    return perm
+    return Permutation(pi, elts)
 
 def inverse_permutation(perm):
-    """ Produce inverse of permutation perm (a permutation as a dict). """
+    """ Produce inverse of permutation perm (a Permutation or a dict). """
+    if isinstance(perm, Permutation):
+        return perm.inverse()
     perm_inv = dict()
     for elt in perm:
         perm_inv[perm[elt]] = elt
@@ -262,11 +332,123 @@ def apply_permutation(perm, x):
     The element starting in position pi[i] ends up in position i.
     The element starting in position elt ends up in position perm_inv[elt].
     """
+    if isinstance(perm, Permutation):
+        return perm.apply(x)
     y = dict()
     for elt in x:
         y[elt] = x[perm[elt]]
     return y
 
+element_positions_cache = dict()    # maps id(elts) to (elts, positions)
+
+def element_positions(elts):
+    """ Return dict mapping each element of list elts to its position.
+
+    Cached, since all permutations of an election share its p_list.
+    """
+    if isinstance(elts, range) and elts.start == 0 and elts.step == 1:
+        return elts             # elt is its own position
+    cached = element_positions_cache.get(id(elts))
+    if cached == None or cached[0] is not elts:
+        if len(element_positions_cache) >= 16:
+            element_positions_cache.clear()
+        cached = (elts, {elt: position for position, elt in enumerate(elts)})
+        element_positions_cache[id(elts)] = cached
+    return cached[1]
+
+class Permutation():
+
+    """ Permutation of a list of elements elts (e.g. an election's p_list).
+
+    Stored as index, an array('I') such that the permutation maps
+    elts[s] to elts[index[s]], so it takes 4 bytes per element instead
+    of a dict of elements.  For reading it behaves like that dict
+    (perm[elt], iteration over elts, len, items, comparison with a dict);
+    to_dict and from_dict convert at serialization boundaries.
+    """
+
+    __slots__ = ('index', 'elts')
+
+    def __init__(self, index, elts):
+        assert len(index) == len(elts)
+        self.index = index if isinstance(index, array) else array('I', index)
+        self.elts = elts
+
+    @classmethod
+    def from_dict(cls, perm, elts):
+        """ Return the Permutation of elts equal to dict perm. """
+        positions = element_positions(elts)
+        return cls([positions[perm[elt]] for elt in elts], elts)
+
+    def to_dict(self):
+        elts = self.elts
+        return {elt: elts[i] for elt, i in zip(elts, self.index)}
+
+    def __getitem__(self, elt):
+        return self.elts[self.index[element_positions(self.elts)[elt]]]
+
+    def __iter__(self):
+        return iter(self.elts)
+
+    def __len__(self):
+        return len(self.elts)
+
+    def keys(self):
+        return iter(self.elts)
+
+    def values(self):
+        elts = self.elts
+        return (elts[i] for i in self.index)
+
+    def items(self):
+        return zip(self.elts, self.values())
+
+    def __eq__(self, other):
+        if isinstance(other, Permutation):
+            return self.index == other.index and self.elts == other.elts
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return "Permutation(%r)" % (self.to_dict(),)
+
+    def inverse(self):
+        """ Return the inverse permutation. """
+        index_inv = array('I', bytes(self.index.itemsize * len(self.index)))
+        for s, i in enumerate(self.index):
+            index_inv[i] = s
+        return Permutation(index_inv, self.elts)
+
+    def compose(self, other):
+        """ Return the permutation mapping elt to self[other[elt]]. """
+        assert other.elts is self.elts or other.elts == self.elts
+        index = self.index
+        return Permutation(array('I', [index[i] for i in other.index]), self.elts)
+
+    def apply(self, x):
+        """ Return apply_permutation(self, x), for x a dict or a list in elts order. """
+        if isinstance(x, dict):
+            elts = self.elts
+            return {elt: x[elts[i]] for elt, i in zip(elts, self.index)}
+        return [x[i] for i in self.index]
+
+def normalize_permutations(d, elts):
+    """ Replace, in place, the dict-form permutations of elts found in nested dict d
+    (e.g. received as JSON) by Permutations, and return d.
+    """
+    for key, value in d.items():
+        if isinstance(value, dict) and len(value) == len(elts) > 0:
+            first = next(iter(value.values()))
+            positions = element_positions(elts)
+            if isinstance(first, str) and first in positions and \
+               all(isinstance(v, str) and v in positions for v in value.values()):
+                d[key] = Permutation.from_dict(value, elts)
+                continue
+        if isinstance(value, dict):
+            normalize_permutations(value, elts)
+    return d
+
 def test_random_permutation():
     """ Test random_permutation. """
     init_randomness_source("test_random_permutation")
@@ -284,8 +466,20 @@ def test_random_permutation():
     perm1 = random_permutation(list(range(100)), "test_random_permutation")
     perm2 = random_permutation(list(range(100)), "test_random_permutation")
     assert perm1 != perm2     # could happen, but with negligible probability
-
-test_random_permutation()
+    # Permutation operations agree with their dict versions
+    elts = ["p%d" % i for i in range(20)]
+    perm1 = random_permutation(elts, "test_random_permutation")
+    perm2 = random_permutation(elts, "test_random_permutation")
+    d1 = perm1.to_dict()
+    assert Permutation.from_dict(d1, elts) == perm1 == d1
+    assert perm1.inverse() == inverse_permutation(d1)
+    assert perm1.compose(perm2) == {elt: perm1[perm2[elt]] for elt in elts}
+    x = {elt: i for i, elt in enumerate(elts)}
+    assert perm1.apply(x) == apply_permutation(d1, x) == apply_permutation(perm1, x)
+    assert perm1.apply(list(range(20))) == [x[perm1[elt]] for elt in elts]
+    d = {'a': {'pi': perm1.to_dict(), 'x': x}}
+    assert normalize_permutations(d, elts) == {'a': {'pi': perm1, 'x': x}}
+    assert isinstance(d['a']['pi'], Permutation)
 
 ##############################################################################
 # PRIMALITY TESTING
@@ -344,8 +538,6 @@ def test_is_prime():
             prime_count += 1
     assert 1229 == prime_count
 
-test_is_prime()
-
 def next_prime(n):
     """ Return the smallest integer greater than n that is prime. """
     assert isinstance(n, int)
@@ -370,8 +562,6 @@ def test_next_prime():
     assert 10**6 + 3 == next_prime(10**6)
     assert 2**256 + 297 == next_prime(2**256)
 
-test_next_prime()
-
 def prev_prime(n):
     """ Return the largest integer less than n that is prime.
 
@@ -400,8 +590,6 @@ def test_prev_prime():
     assert 2**256 - 189 == prev_prime(2**256)
     assert 256**48 - 317 == prev_prime(256**48)
 
-test_prev_prime()
-
 def make_prime(n):
     """ Return next prime greater than or equal to n. """
     if is_prime(n):
@@ -437,8 +625,6 @@ def test_sv_pair():
         [[0, (75, 26)], [1, (13, 89)], [5, (53, 53)], [23, (34, 90)], 
          [79, (51, 28)], [88, (89, 100)]]
 
-test_sv_pair()
-
 ##############################################################################
 # POLYNOMIAL SECRET SHARING (modulo M)
 ##############################################################################
@@ -457,7 +643,7 @@ def share(secret, n, t, rand_name, M):
     assert isinstance(secret, int) and 0 <= secret < M, str(secret)
     assert isinstance(n, int) and 1 < n <= M - 1
     assert isinstance(t, int) and 1 <= t <= n
-    coefs = [get_random_from_source(rand_name, M) for i in range(t)]
+    coefs = get_random_many_from_source(rand_name, t, M)
     coefs[0] = secret
     # print(coefs)
     share_list = []
@@ -490,19 +676,53 @@ def lagrange(share_list, n, t, M):
         share_list = share_list[:t]
     x = [xy[0] for xy in share_list]
     y = [xy[1] for xy in share_list]
-    secret = 0
-    for i in range(t):
-        numerator = 1
-        denominator = 1
-        for j in range(t):
-            if j != i:
-                numerator *= (-x[j]) % M
-                denominator *= (x[i]-x[j]) % M
-        assert denominator != 0
-        denominator_inverse = pow(denominator, M-2, M)
-        assert (denominator * denominator_inverse) % M == 1
-        secret = (secret + y[i] * numerator * denominator_inverse) % M
-    return secret
+    coefficients = lagrange_coefficients(x, M)
+    return sum(c * yi for c, yi in zip(coefficients, y)) % M
+
+lagrange_coefficient_cache = dict()   # maps (x-tuple, M) to coefficients
+
+def lagrange_coefficients(x, M):
+    """ Return coefficients for interpolation at 0 from shares at points x.
+
+    The secret is sum(c[i] * y[i]) mod M, for shares (x[i], y[i]).
+    Coefficients depend only on x and M (and x has exactly t elements),
+    so they are computed once and cached.
+    """
+    key = (tuple(x), M)
+    if key not in lagrange_coefficient_cache:
+        t = len(x)
+        coefficients = []
+        for i in range(t):
+            numerator = 1
+            denominator = 1
+            for j in range(t):
+                if j != i:
+                    numerator = numerator * (-x[j]) % M
+                    denominator = denominator * (x[i]-x[j]) % M
+            assert denominator != 0
+            coefficients.append(numerator * pow(denominator, -1, M) % M)
+        lagrange_coefficient_cache[key] = coefficients
+    return lagrange_coefficient_cache[key]
+
+def lagrange_many(y_lists, n, t, M, x=None):
+    """ return list of secrets, given enough shares of each.
+
+    Batch version of lagrange, for a column of secrets:
+    y_lists[r][s] is the share at point x[r] of secret s.
+    x defaults to 1, 2, ..., len(y_lists) (row number + 1).
+    As in lagrange, the first t points are used.
+    """
+    assert isinstance(n, int)
+    assert isinstance(t, int)
+    assert isinstance(M, int)
+    assert 1 <= t <= n
+    assert n <= M - 1
+    assert len(y_lists) >= t
+    if x == None:
+        x = range(1, len(y_lists)+1)
+    coefficients = lagrange_coefficients(list(x)[:t], M)
+    # columnwise dot product: secret s is sum over r of c[r] * y_lists[r][s]
+    return sv_vector.dot_mod(coefficients, y_lists[:t], M)
 
 def test_share():
     """ Test secret-sharing on a small example. """
@@ -512,8 +732,6 @@ def test_share():
     assert share(3, 5, 3, "test_share", M) == \
         [(1, 4), (2, 10), (3, 10), (4, 4), (5, 3)]
 
-test_share()
-
 def test_lagrange():
     """ Test lagrange on a simple example. """
     n = 5
@@ -526,8 +744,12 @@ def test_lagrange():
     # now re-do, using *last* t shares instead of first t
     share_list.reverse()
     assert secret == lagrange(share_list, n, t, M)
-
-test_lagrange()
+    # and for several secrets at once
+    secrets = [3, 0, 10, 7]
+    share_lists = [share(secret, n, t, "test_lagrange", M) for secret in secrets]
+    y_lists = [[share_list[r][1] for share_list in share_lists] for r in range(n)]
+    assert lagrange_many(y_lists, n, t, M) == secrets
+    assert lagrange_many(y_lists[::-1], n, t, M, x=range(n, 0, -1)) == secrets
 
 ##############################################################################
 # SYMMETRIC ENCRYPTION
@@ -587,8 +809,6 @@ def test_sym_enc():
     msg2 = sym_dec(sym_key, ct)
     assert msg == msg2
 
-test_sym_enc()
-
 ##############################################################################
 # PUBLIC-KEY ENCRYPTION
 ##############################################################################
@@ -625,8 +845,6 @@ def test_pk_enc():
     msg2 = pk_dec(pk, sk, ct)
     assert msg == msg2
 
-test_pk_enc()
-
 ##############################################################################
 # BASIC COMMITMENT FUNCTION com
 ##############################################################################
@@ -644,13 +862,7 @@ def com(v, r_b64):
     base64 (for ease of output) of length
     SECPARAM_HASH_OUTPUT // 6 + 2 (bytes) (approximately).
     """
-    # make sure v has type bytes (by converting from string to bytes if nec.)
-    if isinstance(v, str):
-        v = v.encode()
-    if isinstance(v, int):
-        v = int2bytes(v)
-    assert isinstance(v, (bytes, bytearray)),\
-        "com error: value v must be of type str, int, bytes, or bytearray."
+    v = com_value_bytes(v)
     # check that r_b64 is of right type (str) and length
     assert isinstance(r_b64, str)
     assert len(r_b64) == (SECPARAM_SYMMETRIC // 6) + 2,\
@@ -660,18 +872,44 @@ def com(v, r_b64):
     # than 256, then the choice of hash function has to be changed here.
     # (We can't just use "hash" here, as it isn't compatible with hmac.)
     assert SECPARAM_HASH_OUTPUT == 256
-    h = hashlib.sha256
     r_bytes = base64_2_bytes(r_b64)
-    return bytes2base64(hmac.HMAC(r_bytes, v, h).digest())
+    return bytes2base64(hmac.digest(r_bytes, v, "sha256"))
+
+def com_value_bytes(v):
+    """ Return value v to be committed to as bytes (see com). """
+    # make sure v has type bytes (by converting from string to bytes if nec.)
+    if isinstance(v, int):
+        return int2bytes(v)
+    if isinstance(v, str):
+        return v.encode()
+    assert isinstance(v, (bytes, bytearray)),\
+        "com error: value v must be of type str, int, bytes, or bytearray."
+    return v
+
+def com_many(values, keys):
+    """ Produce commitments to values[0], values[1], ... using keys.
+
+    Batch version of com, for columns of values: values are as for com,
+    keys are the raw randomness (bytes, as produced by get_random_from_source)
+    rather than base64, and the commitments are returned as raw digests
+    (bytes of length SECPARAM_HASH_OUTPUT // 8), so that
+        bytes2base64(com_many([v], [base64_2_bytes(r)])[0]) == com(v, r)
+    """
+    assert len(values) == len(keys)
+    assert SECPARAM_HASH_OUTPUT == 256
+    digest = hmac.digest
+    return [digest(key, com_value_bytes(v), "sha256")
+            for v, key in zip(values, keys)]
 
 def test_com():
-    """ Test commitment function com. """
+    """ Test commitment functions com and com_many. """
     r = 'aaaabbbbccccddddeeeeffffgggghhhhiiiijjjjkkkk'
     # print(com("abc",r))
     assert com("abc", r) == \
         "jolywuOC0afkCY/rmY3YITd08E+79sB+ZFXFpRUYuFU="
-
-test_com()
+    values = ["abc", 0, 255, 2**130, b"abc"]
+    digests = com_many(values, [base64_2_bytes(r)] * len(values))
+    assert [bytes2base64(d) for d in digests] == [com(v, r) for v in values]
 
 ##############################################################################
 # COMMITMENT TO A SPLIT-VALUE PAIR -- comsv
@@ -749,6 +987,12 @@ pickle_protocol = 3
 SERIALIZER = "pickle"
 SERIALIZER = "json"
 
+def json_default(x):
+    """ Convert for json the objects it does not handle: Permutations become dicts. """
+    if isinstance(x, Permutation):
+        return x.to_dict()
+    raise TypeError("Object of type %s is not JSON serializable" % type(x).__name__)
+
 def dump(x, filename):
     """ Dump python data structure x to file fp. """
     if SERIALIZER == "json":
@@ -758,6 +1002,7 @@ def dump(x, filename):
             fp = open(filename, "w")
         json.dump(x, fp,
                   sort_keys=json_parameters['json_sort_keys'],
+                  default=json_default,
                   ensure_ascii = False, # needed ?
                   indent=json_parameters['json_indent'])
         fp.close()
@@ -773,6 +1018,7 @@ def dumps(x):
     if SERIALIZER == "json":
         return json.dumps(x,
                           sort_keys=json_parameters['json_sort_keys'],
+                          default=json_default,
                           ensure_ascii = False, # needed ?
                           indent=json_parameters['json_indent'])
     elif SERIALIZER == "pickle":
@@ -803,7 +1049,7 @@ def loads(x):
 # UPDATE NESTED DICTIONARIES
 ##############################################################################
  
-import collections
+import collections.abc
 def update_nested_dict(d, u):
     """
     It modifies d as well
@@ -818,11 +1064,129 @@ def update_nested_dict(d, u):
             # pickle does have this problem
         except ValueError:
             pass
-        if isinstance(v, collections.Mapping):
+        if isinstance(v, collections.abc.Mapping):
             r = update_nested_dict(d.get(k, {}), v)
             d[k] = r
         else:
             d[k] = u[k]
         if k == '1':
             print("IN update_nested_dict '1':", str(d))
-    return d
\ No newline at end of file
+    return d
+
+def split_nested_dict(d, key_chunks):
+    """
+    Generate one piece of nested dict d for each list of keys in key_chunks.
+    Innermost dicts indexed by those keys (e.g. by p_list) are cut according to
+    key_chunks, any other value goes with the first piece. Applying all pieces with
+    update_nested_dict gives back d, so a large d can be sent a bounded piece at a time.
+    Pieces are built only when requested, and empty ones are skipped (so d without
+    such dicts is one piece; an empty d is one empty piece). Permutations are not
+    cut: each one is sent in a piece of its own, after the others.
+    split_nested_dict({'x': {'p0': 5, 'p1': 7}, 'n': 2}, [['p0'], ['p1']]) # {'x': {'p0': 5}, 'n': 2}, {'x': {'p1': 7}}
+    """
+    all_keys = set()
+    for chunk in key_chunks:
+        all_keys.update(chunk)
+    pieces = 0
+    for chunk_index, chunk in enumerate(key_chunks):
+        piece = restrict_nested_dict(d, chunk, all_keys, chunk_index == 0)
+        if len(piece) > 0:
+            pieces += 1
+            yield piece
+    if pieces == 0 and len(d) == 0:
+        yield dict()
+    for path, perm in permutation_leaves(d):
+        piece = perm
+        for k in reversed(path):
+            piece = {k: piece}
+        yield piece
+
+def permutation_leaves(d, path=()):
+    """ Generate (path, permutation) for each Permutation in nested dict d """
+    for k, v in d.items():
+        if isinstance(v, Permutation):
+            yield path + (k,), v
+        elif isinstance(v, dict):
+            yield from permutation_leaves(v, path + (k,))
+
+def restrict_nested_dict(d, chunk, all_keys, keep_other_values):
+    """ Return the piece of d for chunk (see split_nested_dict) """
+    piece = dict()
+    for k, v in d.items():
+        if isinstance(v, dict) and len(v) > 0 and next(iter(v)) in all_keys:
+            vector_piece = {key: v[key] for key in chunk if key in v}
+            if len(vector_piece) > 0:
+                piece[k] = vector_piece
+        elif isinstance(v, dict):
+            sub_piece = restrict_nested_dict(v, chunk, all_keys, keep_other_values)
+            if len(sub_piece) > 0 or (keep_other_values and len(v) == 0):
+                piece[k] = sub_piece
+        elif keep_other_values and not isinstance(v, Permutation):
+            piece[k] = v
+    return piece
+
+def test_split_nested_dict():
+    """ Test split_nested_dict and update_nested_dict. """
+    init_randomness_source("test_split_nested_dict")
+    elts = ["p%d" % i for i in range(20)]
+    d = dict()
+    for i in ['a', 'b']:
+        d[i] = {0: {'pi_seed': '00ff'}}
+        for k in ['k0', 'k1']:
+            pi = random_permutation(elts, "test_split_nested_dict")
+            d[i][0][k] = {'pi': pi, 'x': {elt: get_random_from_source("test_split_nested_dict")
+                                          for elt in elts}}
+    key_chunks = [elts[:7], elts[7:14], elts[14:]]
+    pieces = list(split_nested_dict(d, key_chunks))
+    assert len(pieces) == len(key_chunks) + 4
+    for chunk, piece in zip(key_chunks, pieces):
+        assert sorted(piece['b'][0]['k1']['x']) == sorted(chunk)
+    merged = dict()
+    for piece in pieces:
+        update_nested_dict(merged, piece)
+    assert merged == d
+    assert isinstance(merged['a'][0]['k0']['pi'], Permutation)
+    # no empty pieces: a slice of elts, and values without vectors
+    d = {'a': {0: {'k0': {'x': {elt: 1 for elt in elts[9:12]}}}}}
+    assert list(split_nested_dict(d, key_chunks)) == [d]
+    d = {'a': {0: {'pi_seed': '00ff'}}, 'b': {0: {'pi_seed': '00ff'}}}
+    assert list(split_nested_dict(d, key_chunks)) == [d]
+    assert list(split_nested_dict({}, key_chunks)) == [{}]
+
+
+##############################################################################
+# SELF-TESTS
+##############################################################################
+
+def self_test():
+    """ Run the self-tests of this module.
+        They take a noticeable fraction of a second, so they are not run on import
+        unless the environment variable SV_SELF_TEST is set to 1.
+    """
+    test_conversions()
+    test_random()
+    test_random_many()
+    test_split_randomness_source()
+    test_random_permutation()
+    test_split_nested_dict()
+    test_is_prime()
+    test_next_prime()
+    test_prev_prime()
+    test_sv_pair()
+    test_share()
+    test_lagrange()
+    test_sym_enc()
+    test_pk_enc()
+    test_com()
+    sv_vector.test_vector()
+    import sv_codec     # sv_codec and sv_server import sv
+    sv_codec.test_codec()
+    import sv_server
+    sv_server.test_zero_sharing()
+
+if os.environ.get("SV_SELF_TEST") == "1":
+    self_test()
+
+if __name__ == "__main__":
+    self_test()
+    print("sv.py self-tests passed")
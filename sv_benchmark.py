@@ -0,0 +1,98 @@
+# sv_benchmark.py
+# python3
+
+"""
+Microbenchmarks for the primitives of sv.py that dominate election time.
+
+Usage:
+        python3 sv_benchmark.py
+  or
+        python3 sv_benchmark.py n
+        where n is the number of operations per benchmark (default 100000)
+"""
+
+# MIT open-source license.
+# (See https://github.com/ron-rivest/split-value-voting.git)
+
+import sys
+assert sys.version_info[0] == 3
+import time
+
+import sv
+import sv_vector
+
+def best_time(f, repeat=3):
+    """ Return the best wall-clock time of repeat calls to f(), in seconds. """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+def report(name, n, seconds):
+    print("    %-40s %12.0f per second" % (name, n / seconds))
+
+def benchmark_commitments(n):
+    """ Commitments per second: sv.com one at a time versus sv.com_many. """
+    M = sv.make_prime(256**16)
+    rand_name = "benchmark_commitments"
+    sv.init_randomness_source(rand_name)
+    values = sv.get_random_many_from_source(rand_name, n, M)
+    keys = sv.get_random_many_from_source(rand_name, n)
+    keys_b64 = [sv.bytes2base64(key) for key in keys]
+    print("commitments (%d values < 2**128):" % n)
+    report("sv.com",
+           n, best_time(lambda: [sv.com(v, r) for v, r in zip(values, keys_b64)]))
+    report("sv.com_many",
+           n, best_time(lambda: sv.com_many(values, keys)))
+    report("sv.com_many, base64 commitments",
+           n, best_time(lambda: [sv.bytes2base64(c)
+                                 for c in sv.com_many(values, keys)]))
+
+def benchmark_lagrange(n, rows=3, t=2):
+    """ Reconstructions per second: sv.lagrange one at a time versus sv.lagrange_many. """
+    M = sv.make_prime(256**16)
+    rand_name = "benchmark_lagrange"
+    sv.init_randomness_source(rand_name)
+    y_lists = [sv.get_random_many_from_source(rand_name, n, M) for _ in range(rows)]
+    share_lists = [[(row+1, y_lists[row][s]) for row in range(rows)]
+                   for s in range(n)]
+    print("lagrange (%d secrets < 2**128, %d of %d shares):" % (n, t, rows))
+    report("sv.lagrange",
+           n, best_time(lambda: [sv.lagrange(share_list, rows, t, M)
+                                 for share_list in share_lists]))
+    report("sv.lagrange_many",
+           n, best_time(lambda: sv.lagrange_many(y_lists, rows, t, M)))
+
+def benchmark_vector(n):
+    """ Vector operations per second, with each engine of sv_vector. """
+    print("vector arithmetic (%d values, NumPy %s):" %
+          (n, "not installed" if sv_vector.numpy == None else "installed"))
+    use_numpy = sv_vector.USE_NUMPY
+    for M in [sv.make_prime(256**3), sv.make_prime(256**16)]:
+        rand_name = "benchmark_vector"
+        sv.init_randomness_source(rand_name)
+        x = sv.get_random_many_from_source(rand_name, n, M)
+        fuzz = sv.get_random_many_from_source(rand_name, n, M)
+        index = sorted(range(n), key=fuzz.__getitem__)   # some permutation
+        for sv_vector.USE_NUMPY in [True, False]:
+            engine = "numpy" if sv_vector.use_numpy(M) else "python"
+            report("add_mod, M < 2**%d, %s" % (M.bit_length(), engine),
+                   n, best_time(lambda: sv_vector.add_mod(x, fuzz, M, index)))
+            report("dot_mod (2 rows), M < 2**%d, %s" % (M.bit_length(), engine),
+                   n, best_time(lambda: sv_vector.dot_mod([3, M-2], [x, fuzz], M)))
+    sv_vector.USE_NUMPY = use_numpy
+
+def run_benchmarks(n):
+    benchmark_commitments(n)
+    benchmark_lagrange(n)
+    benchmark_vector(n)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run_benchmarks(int(sys.argv[1]))
+    else:
+        run_benchmarks(100000)
@@ -0,0 +1,182 @@
+# sv_codec.py
+# python3
+
+""" Compact binary encoding of the sdb updates exchanged by mix servers.
+
+An update is a nested dict sdb[race_id][i][j][k][name] whose leaves are
+vectors indexed by election.p_list:
+    x, y, u, v, fuzz_dict       ints modulo race_modulus
+    pi, pi_inv                  permutations of p_list (sv.Permutation or dict)
+(or by a contiguous slice of it, when an update is streamed in pieces, see
+sv.split_nested_dict). Each such vector is moved to a binary attachment,
+in p_list order so the voter indices are implicit: ints as fixed-width
+little-endian integers sized by race_modulus, permutations as the positions
+in p_list of their values. The rest of the update (the skeleton) stays in
+the message, with a {VECTOR_KEY: [kind, width, offset, start, count]}
+placeholder for each vector of p_list[start:start+count]; offsets are
+explicit since the serializer may reorder keys. Whole permutations are
+decoded as sv.Permutation.
+"""
+
+# MIT open-source license.
+# (See https://github.com/ron-rivest/split-value-voting.git)
+
+import struct
+
+import sv
+
+VECTOR_KEY = "vector"   # placeholder for a vector moved to the attachment
+KIND_INT = 0            # ints modulo race_modulus
+KIND_PERMUTATION = 1    # pi or pi_inv
+STRUCT_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'} # widths struct can handle in one call
+
+def byte_width(n):
+    """ Return number of bytes needed to represent 0..n-1. """
+    return max(1, ((n-1).bit_length() + 7) // 8)
+
+def encode_sdb_update(election, dict_update):
+    """ Return (skeleton, attachment) encoding dict_update. """
+    p_list = election.p_list
+    p_index = {p: index for index, p in enumerate(p_list)}
+    attachment = bytearray()
+    skeleton = dict()
+    for race in election.races:
+        if race.race_id in dict_update:
+            skeleton[race.race_id] = \
+                encode_subtree(dict_update[race.race_id], p_list, p_index,
+                               byte_width(race.race_modulus), attachment)
+    for race_id in dict_update:
+        assert race_id in skeleton, "unknown race_id " + str(race_id)
+    return skeleton, attachment
+
+def encode_subtree(d, p_list, p_index, int_width, attachment):
+    """ Return skeleton of d, appending the vectors of d to attachment. """
+    skeleton = dict()
+    for key, value in d.items():
+        if isinstance(value, sv.Permutation):
+            skeleton[key] = encode_permutation(value, p_list, attachment)
+        elif not isinstance(value, dict):
+            skeleton[key] = value
+        elif is_vector(value, p_index):
+            skeleton[key] = encode_vector(value, p_list, p_index, int_width, attachment)
+        else:
+            skeleton[key] = encode_subtree(value, p_list, p_index, int_width, attachment)
+    return skeleton
+
+def is_vector(d, p_index):
+    """ Return True if d is indexed by a contiguous slice of p_list. """
+    if len(d) == 0 or not all(key in p_index for key in d):
+        return False
+    start = min(p_index[key] for key in d)
+    return all(p_index[key] - start < len(d) for key in d)
+
+def encode_vector(vector, p_list, p_index, int_width, attachment):
+    """ Append vector to attachment and return its placeholder.
+    Vectors that do not fit (e.g. negative values) are returned unchanged.
+    """
+    start = min(p_index[key] for key in vector)
+    count = len(vector)
+    values = [vector[p] for p in p_list[start:start+count]]
+    try:
+        if all(type(value) == int for value in values):
+            kind, width = KIND_INT, int_width
+            piece = pack_ints(values, width)
+        elif all(value in p_index for value in values):
+            kind, width = KIND_PERMUTATION, byte_width(len(p_list))
+            piece = pack_ints([p_index[value] for value in values], width)
+        else:
+            return vector
+    except (OverflowError, TypeError, struct.error):
+        return vector
+    offset = len(attachment)
+    attachment += piece
+    return {VECTOR_KEY: [kind, width, offset, start, count]}
+
+def encode_permutation(perm, p_list, attachment):
+    """ Append the index of Permutation perm of p_list to attachment and return its placeholder. """
+    assert perm.elts is p_list or perm.elts == p_list
+    width = byte_width(len(p_list))
+    offset = len(attachment)
+    attachment += pack_ints(perm.index, width)
+    return {VECTOR_KEY: [KIND_PERMUTATION, width, offset, 0, len(p_list)]}
+
+def pack_ints(values, width):
+    """ Return values as width-byte little-endian unsigned integers. """
+    if width in STRUCT_FORMATS:
+        return struct.pack('<%d%s' % (len(values), STRUCT_FORMATS[width]), *values)
+    return b''.join([value.to_bytes(width, 'little') for value in values])
+
+def unpack_ints(data, width):
+    """ Inverse of pack_ints. """
+    if width in STRUCT_FORMATS:
+        return struct.unpack('<%d%s' % (len(data) // width, STRUCT_FORMATS[width]), data)
+    from_bytes = int.from_bytes
+    return [from_bytes(data[index:index+width], 'little')
+            for index in range(0, len(data), width)]
+
+def decode_sdb_update(election, skeleton, attachment):
+    """ Return the dict_update encoded by encode_sdb_update. """
+    return decode_subtree(skeleton, election.p_list, attachment)
+
+def decode_subtree(skeleton, p_list, attachment):
+    d = dict()
+    for key, value in skeleton.items():
+        if isinstance(value, dict) and VECTOR_KEY in value:
+            d[key] = decode_vector(value[VECTOR_KEY], p_list, attachment)
+        elif isinstance(value, dict):
+            d[key] = decode_subtree(value, p_list, attachment)
+        else:
+            d[key] = value
+    return d
+
+def decode_vector(placeholder, p_list, attachment):
+    kind, width, offset, start, count = placeholder
+    data = attachment[offset:offset + width * count]
+    assert len(data) == width * count, "attachment too short"
+    values = unpack_ints(data, width)
+    if kind == KIND_PERMUTATION and count == len(p_list):
+        return sv.Permutation(values, p_list)
+    if kind == KIND_PERMUTATION:
+        values = [p_list[value] for value in values]
+    else:
+        assert kind == KIND_INT
+    return dict(zip(p_list[start:start+count], values))
+
+def test_codec():
+    """ Test that decode_sdb_update inverts encode_sdb_update. """
+    import types
+    M = 2**128 + 51     # a 129-bit race_modulus
+    p_list = ["p%d" % index for index in range(300)]
+    election = types.SimpleNamespace(
+        p_list=p_list,
+        races=[types.SimpleNamespace(race_id="race1", race_modulus=M),
+               types.SimpleNamespace(race_id="race2", race_modulus=11)])
+    sv.init_randomness_source("test_codec")
+    pi = sv.random_permutation(p_list, "test_codec")
+    x = {p: (M - 1 - index * 2**100) % M for index, p in enumerate(p_list)}
+    x[p_list[1]] = 0
+    x[p_list[2]] = 2**128
+    dict_update = {"race1": {'a': {0: {'pi_seed': 'ff00',
+                                       '0': {'pi': pi, 'x': x}}}},
+                   "race2": {'b': {1: {'1': {'y': {p: 10 for p in p_list}}}}}}
+    # the pieces of a streamed update hold slices of p_list
+    pieces = list(sv.split_nested_dict(dict_update, [p_list[:128], p_list[128:]]))
+    pieces.append({"race2": {'a': {1: {'1': {'pi_inv': {p: pi[p] for p in p_list[7:14]},
+                                             'v': {p: -1 for p in p_list[7:14]}}}}}})
+    for d in [dict_update] + pieces:
+        skeleton, attachment = encode_sdb_update(election, d)
+        assert decode_sdb_update(election, skeleton, bytes(attachment)) == d
+    skeleton, attachment = encode_sdb_update(election, dict_update)
+    assert skeleton["race1"]['a'][0]['pi_seed'] == 'ff00'
+    assert skeleton["race1"]['a'][0]['0']['x'] == {VECTOR_KEY: [KIND_INT, 17, 2 * 300, 0, 300]}
+    assert len(attachment) == 300 * (17 + 2 + 1)
+    decoded = decode_sdb_update(election, skeleton, attachment)
+    assert isinstance(decoded["race1"]['a'][0]['0']['pi'], sv.Permutation)
+    # vectors that do not fit are left in the skeleton
+    skeleton, attachment = encode_sdb_update(election, pieces[-1])
+    assert skeleton["race2"]['a'][1]['1']['v'] == pieces[-1]["race2"]['a'][1]['1']['v']
+    assert skeleton["race2"]['a'][1]['1']['pi_inv'] == {VECTOR_KEY: [KIND_PERMUTATION, 2, 0, 7, 7]}
+
+if __name__ == "__main__":
+    test_codec()
+    print("sv_codec.py self-tests passed")
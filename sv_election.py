@@ -33,11 +33,11 @@ import sv_verifier
 
 #import socketserver
 import ServerConfiguration as SC##information about network
-import threading
 #import socket
 import sys
 from ServerController import ControllerServer
 from ServerController import ControllerHandler
+from ServerAsync import start_server_thread
 from ServerController import data_transferred_size
 import ServerController
 import time
@@ -166,11 +166,9 @@ class Election:
         time_performance["0 Election begins"] = time.time() - start_time
         #   0B. Start Controller Server
         # Create the server, binding to 127.0.0.1
-        server = ControllerServer((SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), ControllerHandler) #or use a ThreadedTCPServer to handle each request in a different thread.    
+        server = ControllerServer((SC.CONTROLLER_HOST, SC.CONTROLLER_PORT), ControllerHandler, self)
         # Activate the server; this will keep running until you interrupt the program with Ctrl+C
-        server_thread = threading.Thread(target=server.serve_forever, daemon = True)
-        #daemon threads allow us to finish the program execution, even though some threads may be running
-        server_thread.start()
+        server_thread = start_server_thread(server)
         time_performance["0.B Start Controller Server"] = time.time() - start_time
         
         #   1. Start Generic Servers, and have them ping the controller. Wait for enough servers
@@ -250,6 +248,8 @@ class Election:
           performance_stats["Election Parameters:"] = self.election_parameters
           print("Data transferred:", ServerController.data_transferred_size)
           performance_stats["Data transferred by Controller:"] = ServerController.data_transferred_size
+          print("Data transferred on the wire:", ServerController.data_transferred_wire_size)
+          performance_stats["Data transferred by Controller on the wire:"] = ServerController.data_transferred_wire_size
           print("Performance stats written to " + self.election_id +".performance_stats.txt")
           sv.dump(performance_stats, self.election_id+".performance_stats.txt")
 
@@ -30,7 +30,7 @@ default_election_parameters = {
                 "rufus",
                 "****************"))],  # 16-char write-ins allowed
     "n_voters": 1000,   # voters # TODO run tests with 100, 1000 and 10000 (?)
-    "n_reps": 24,         # (# of replicas aka 2m) # TODO if increase 2m, increase MSG_BUFFER_SIZE
+    "n_reps": 24,         # (# of replicas aka 2m)
     "n_fail": 0,         # how many servers may fail  #TODO change it back to 1
     "n_leak": 2,         # how many servers may leak
 
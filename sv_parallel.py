@@ -0,0 +1,60 @@
+# sv_parallel.py
+# python3
+
+""" Pool of worker processes for independent work units of the servers.
+
+Independent work units (e.g. one per (race, k)) may be computed by a pool
+of worker processes.  Units draw their randomness from sources split off
+with sv.split_randomness_source, so results do not depend on the number
+of processes.
+"""
+
+# MIT open-source license.
+# (See https://github.com/ron-rivest/split-value-voting.git)
+
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+
+worker_pool = None              # created on first use, then reused
+worker_pool_processes = None    # number of processes of worker_pool
+worker_pool_lock = threading.Lock()
+
+def map_work(function, args_list, processes):
+    """ Return [function(*args) for args in args_list].
+
+    With processes > 1 the calls run in a pool of that many worker processes,
+    so function must be a module-level function and args and results
+    must be picklable.  Workers are spawned, not forked, since servers
+    call this from threads.
+    """
+    global worker_pool, worker_pool_processes
+    args_list = list(args_list)
+    if processes <= 1 or len(args_list) <= 1:
+        return [function(*args) for args in args_list]
+    with worker_pool_lock:
+        if worker_pool != None and worker_pool_processes != processes:
+            worker_pool.shutdown(wait=False)
+            worker_pool = None
+        if worker_pool == None:
+            worker_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=exit_with_parent,
+                initargs=(os.getpid(),))
+            worker_pool_processes = processes
+        pool = worker_pool
+    return list(pool.map(function, *zip(*args_list)))
+
+def exit_with_parent(parent_pid):
+    """ Make this worker process exit once process parent_pid is gone.
+
+    Otherwise workers of a killed server would wait for work forever.
+    """
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
@@ -11,6 +11,9 @@
 # (See https://github.com/ron-rivest/split-value-voting.git)
 
 import sv
+import sv_parallel
+import sv_vector
+import ServerConfiguration as SC
 
 ##############################################################################
 # output commitments
@@ -28,35 +31,43 @@ def compute_output_commitments(election, row_index, col_index):
     """
     cols = election.server.cols
     full_output = dict()
+    work_units = []             # (race_id, k) of each unit of work_args
+    work_args = []
     for race in election.races:
-        race_modulus = race.race_modulus
         race_id = race.race_id
         full_output[race_id] = dict()
+        if col_index == cols -1: # TODO move this logic to ServerMix handler
+            i = row_index
+            rand_name = election.server.sdb[race_id][i][cols-1]['rand_name']
+            sv.init_randomness_source(rand_name) # TODO optional remove later
         for k in election.k_list:
             full_output[race_id][k] = dict()
             for py in election.p_list:
                 full_output[race_id][k][py] = dict()
-                if col_index == cols -1: # TODO move this logic to ServerMix handler
-                    i = row_index
-                    rand_name = \
-                        election.server.sdb[race_id][i][cols-1]['rand_name']
-                    sv.init_randomness_source(rand_name) # TODO optional remove later
-                    sdbp = election.server.sdb[race_id][i][cols-1][k]
-                    y = sdbp['y'][py]
-                    (u, v) = sv.get_sv_pair(y, rand_name, race_modulus)
-                    ru = sv.bytes2base64(sv.get_random_from_source(rand_name))
-                    rv = sv.bytes2base64(sv.get_random_from_source(rand_name))
-                    cu = sv.com(u, ru)
-                    cv = sv.com(v, rv)
-                    sdbp['u'][py] = u
-                    sdbp['v'][py] = v
-                    sdbp['ru'][py] = ru
-                    sdbp['rv'][py] = rv
-                    sdbp['cu'][py] = cu
-                    sdbp['cv'][py] = cv
-                    ballot = {'y': y, 'u': u, 'v': v,
-                              'ru': ru, 'rv': rv, 'cu': cu, 'cv': cv}
-                    full_output[race_id][k][py][i] = ballot
+            if col_index == cols -1:
+                sdbp = election.server.sdb[race_id][i][cols-1][k]
+                # independent stream per (race, k), so passes may be done in any process
+                k_rand_name = sv.split_randomness_source(rand_name, "output:" + k)
+                ys = [sdbp['y'][py] for py in election.p_list]
+                work_units.append((race_id, k))
+                work_args.append((k_rand_name, sv.randomness_sources[k_rand_name],
+                                  ys, race.race_modulus))
+    results = sv_parallel.map_work(make_output_commitments, work_args, SC.WORKER_PROCESSES)
+    for (race_id, k), args, (us, vs, rus, rvs, cus, cvs) in zip(work_units, work_args, results):
+        ys = args[2]
+        sdbp = election.server.sdb[race_id][i][cols-1][k]
+        for index, py in enumerate(election.p_list):
+            y, u, v = ys[index], us[index], vs[index]
+            ru, rv, cu, cv = rus[index], rvs[index], cus[index], cvs[index]
+            sdbp['u'][py] = u
+            sdbp['v'][py] = v
+            sdbp['ru'][py] = ru
+            sdbp['rv'][py] = rv
+            sdbp['cu'][py] = cu
+            sdbp['cv'][py] = cv
+            ballot = {'y': y, 'u': u, 'v': v,
+                      'ru': ru, 'rv': rv, 'cu': cu, 'cv': cv}
+            full_output[race_id][k][py][i] = ballot
     election.full_output = full_output
     coms = dict()
     # same as full_output, but only giving non-secret values (i.e. cu, cv)
@@ -80,9 +91,32 @@ def compute_output_commitments(election, row_index, col_index):
     election.output_commitments = coms
     return ("proof:output_commitments", {"commitments": coms})
 
+def make_output_commitments(rand_name, seed, ys, race_modulus):
+    """ Return (us, vs, rus, rvs, cus, cvs) for one (race, k) pass.
+
+    For each share y in ys, split it as u + v (mod race_modulus) and
+    commit to u and v with new keys ru and rv (base64, as are cu and cv).
+    Randomness comes from source rand_name with the given seed, so the
+    result is the same in whichever process this runs (see sv_parallel.map_work).
+    """
+    sv.init_randomness_source(rand_name, seed)
+    # u, ru, rv for each y, in that order
+    random_outputs = sv.get_random_many_from_source(rand_name, 3*len(ys))
+    us = [sv.bytes2int(r) % race_modulus for r in random_outputs[0::3]]
+    vs = [(y-u) % race_modulus for y, u in zip(ys, us)]
+    cus = sv.com_many(us, random_outputs[1::3])
+    cvs = sv.com_many(vs, random_outputs[2::3])
+    b64 = sv.bytes2base64
+    return (us, vs,
+            [b64(r) for r in random_outputs[1::3]],
+            [b64(r) for r in random_outputs[2::3]],
+            [b64(c) for c in cus],
+            [b64(c) for c in cvs])
+
 ##############################################################################
 # cut-and-choose challenge section
 ##############################################################################
+
 def make_cut_verifier_challenges(election, sbb_hash):
     """ Return a dict containing "verifier challenges" for this proof.
 
@@ -143,6 +177,30 @@ def share_icl_pik_dict(election, challenges, row_index, col_index):
             pik_dict_to_share[race_id][i][j][k]['pi_inv'] = election.server.sdb[race_id][i][j][k]['pi_inv']
     return pik_dict_to_share
 
+def composed_permutation(election, race_id, i, k):
+    """ Return (pik, pik_inv) for race race_id and copy k, from the pi's of row i.
+
+    pik is the composition of the permutations of all columns: it maps
+    each py of the last column to the px of the first column it comes from,
+    and pik_inv maps px to py.  They are computed once and cached in
+    sdb[race_id][i][cols-1][k], since several proof steps trace votes
+    through the mix.
+    """
+    server = election.server
+    cols = server.cols
+    sdbp = server.sdb[race_id][i][cols-1][k]
+    if 'pik' not in sdbp:
+        pik = None
+        for j in range(cols):
+            pi = server.sdb[race_id][i][j][k]['pi']
+            if not isinstance(pi, sv.Permutation):
+                pi = sv.Permutation.from_dict(pi, election.p_list)
+            # px = pi_0[pi_1[...pi_{cols-1}[py]]]
+            pik = pi if pik == None else pik.compose(pi)
+        sdbp['pik'] = pik
+        sdbp['pik_inv'] = pik.inverse()
+    return sdbp['pik'], sdbp['pik_inv']
+
 def compute_and_post_pik_dict(election, challenges, row_index, col_index):
     """ Compute a permutation pi for each race and ballot in that race, post it.
 
@@ -151,21 +209,16 @@ def compute_and_post_pik_dict(election, challenges, row_index, col_index):
     so we don't need to loop on i.
     """
     icl = challenges['cut']['icl']
-    server = election.server
-    cols = server.cols
     pik_dict = dict()
     for race in election.races:
         race_id = race.race_id
         pik_dict[race_id] = dict()
         for k in icl:
-            pik_dict[race_id][k] = dict()
-            for py in election.p_list:
-                px = py
-                for j in range(cols-1, -1, -1):
-                    pi = server.sdb[race_id]['a'][j][k]['pi']
-                    px = pi[px]
-                pik_dict[race_id][k][py] = px
-            # now pik maps py's to their original px's
+            # every row has the same pi's; use this server's row, whose
+            # composed permutation is reused by the other proof steps
+            pik, pik_inv = composed_permutation(election, race_id, row_index, k)
+            # pik maps py's to their original px's
+            pik_dict[race_id][k] = pik.to_dict()
     return ("proof:input_consistency:pik_for_k_in_icl",
                       {'pik_dict': pik_dict})
 
@@ -212,28 +265,27 @@ def compute_and_post_t_values(election, challenges, row_index, col_index):
     server = election.server
     cols = server.cols
     icl = challenges['cut']['icl']
+    p_list = election.p_list
+    p_index = {p: index for index, p in enumerate(p_list)}
     ts = dict()
     for race in election.races:
         race_id = race.race_id
+        i = row_index
+        ux_list = [server.sdb[race_id][i][0]['u'][px] for px in p_list]
+        vx_list = [server.sdb[race_id][i][0]['v'][px] for px in p_list]
         ts[race_id] = dict()
         for k in icl:
             ts[race_id][k] = dict()
-            for px in election.p_list:
-                ts[race_id][k][px] = dict()
-                i = row_index
-                ts[race_id][k][px][i] = dict()
-                ux = server.sdb[race_id][i][0]['u'][px]
-                vx = server.sdb[race_id][i][0]['v'][px]
-                py = px
-                for j in range(cols):
-                    pi_inv = server.sdb[race_id][i][j][k]['pi_inv']
-                    py = pi_inv[py]
-                uy = server.sdb[race_id][i][cols-1][k]['u'][py]
-                vy = server.sdb[race_id][i][cols-1][k]['v'][py]
-                tu = (uy-ux) % race.race_modulus
-                tv = (vy-vx) % race.race_modulus
-                ts[race_id][k][px][i]["tu"] = tu
-                ts[race_id][k][px][i]["tv"] = tv
+            # trace each px through the mix to its py
+            pik, pik_inv = composed_permutation(election, race_id, i, k)
+            py_index = sv_vector.permutation_index(pik_inv, p_list, p_index)
+            sdbp = server.sdb[race_id][i][cols-1][k]
+            tu_list = sv_vector.sub_mod([sdbp['u'][py] for py in p_list], ux_list,
+                                        race.race_modulus, index=py_index)
+            tv_list = sv_vector.sub_mod([sdbp['v'][py] for py in p_list], vx_list,
+                                        race.race_modulus, index=py_index)
+            for px, tu, tv in zip(p_list, tu_list, tv_list):
+                ts[race_id][k][px] = {i: {"tu": tu, "tv": tv}}
     return ("proof:output_commitment_t_values", {"t_values": ts})
 
 ##############################################################################
@@ -374,13 +426,10 @@ def prove_input_consistent_output_openings(election, challenges, row_index, col_
             coms[race_id][k] = dict()
             for py in election.p_list:
                 coms[race_id][k][py] = dict()
-            for py in election.p_list:
-                i = row_index
-                sdbp = election.server.sdb
-                px = py
-                for j in range(cols-1, -1, -1):
-                    pi = sdbp[race_id][i][j][k]['pi']
-                    px = pi[px]
+            i = row_index
+            sdbp = election.server.sdb
+            pik, pik_inv = composed_permutation(election, race_id, i, k)
+            for py, px in pik.items():
                 if leftright[px] == "left":
                     com = {"u": sdbp[race_id][i][cols-1][k]['u'][py],
                            "ru": sdbp[race_id][i][cols-1][k]['ru'][py]}
@@ -65,14 +65,17 @@ class Race:
         self.rand_name = rand_name
         sv.init_randomness_source(rand_name)
 
-    def random_choice(self):
+    def random_choice(self, rand_name=None):
         """ Return a random choice for this race.
 
         If write-ins are allowed, then pick a write_in from
         a small built-in list of alternatives.
+        Randomness comes from rand_name if given, else from the race's source.
         """
 
-        choice_index = sv.get_random_from_source(self.rand_name,
+        if rand_name == None:
+            rand_name = self.rand_name
+        choice_index = sv.get_random_from_source(rand_name,
                                                  len(self.choices))
         choice = self.choices[choice_index]
         all_stars = all([c == "*" for c in choice])
@@ -81,7 +84,7 @@ class Race:
         # select write_in from fixed list of alternatives
         # but truncate if needed so it is not longer than list of stars
         max_len_write_in = len(choice)
-        index = sv.get_random_from_source(self.rand_name, len(WRITE_INS))
+        index = sv.get_random_from_source(rand_name, len(WRITE_INS))
         choice = WRITE_INS[index][:max_len_write_in]
         return choice
 
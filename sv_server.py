@@ -11,9 +11,12 @@
 # MIT open-source license.
 # (See https://github.com/ron-rivest/split-value-voting.git)
 
+import itertools
 import sv
+import sv_parallel
+import sv_vector
 from copy import deepcopy
-
+import ServerConfiguration as SC
 
 class Server():
 
@@ -144,6 +147,55 @@ class Server():
         assert type(role_index)==int
         return role_index % self.cols
 
+    def get_servers_in_row(self, row_index):
+        return [self.get_server_index(row_index, j) for j in range(self.cols)]
+
+    def get_servers_in_col(self, col_index):
+        return [self.get_server_index(i, col_index) for i in self.row_list]
+
+    def get_mix_phase_participants(self, phase):
+        """ Return role indices of the servers that have work in the given mix phase,
+        or None once all phases are done. Must agree with MixHandler.handle_mix.
+        """
+        assert type(phase)==int
+        if phase == 1:
+            return self.get_servers_in_col(0)       # replicate input
+        elif phase == 3 and (SC.PERMUTATION_SEEDS or SC.FUZZ_SEEDS):
+            return list(range(self.rows*self.cols)) # obfuscation values, values from seeds
+        elif phase == 2 or phase == 3:
+            return self.get_servers_in_row('a')     # permutations and obfuscation values
+        elif phase == 4 and SC.MIX_PIPELINED:
+            return list(range(self.rows*self.cols)) # all columns at once, pass by pass
+        elif phase > 3 and phase <= 3+self.cols and not SC.MIX_PIPELINED:
+            return self.get_servers_in_col(phase-4) # mix one column at a time
+        elif phase == 0:
+            return []
+        return None
+
+    def get_prove_phase_participants(self, phase):
+        """ Return role indices of the servers that have work in the given prove phase,
+        or None once all phases are done. Must agree with MixHandler.handle_prove.
+        """
+        assert type(phase)==int
+        all_servers = list(range(self.rows*self.cols))
+        first_col = self.get_servers_in_col(0)
+        last_col = self.get_servers_in_col(self.cols-1)
+        participants = {0: last_col,          # output commitments
+                        1: all_servers,       # cut-and-choose challenges, needed by everyone in phase 2
+                        2: all_servers,       # share pi for k in icl
+                        3: [0],               # post pik
+                        4: first_col,         # share ux, vx with last column
+                        5: last_col,          # t values
+                        6: sorted(set(first_col + last_col)), # leftright challenges, needed in phases 8 and 9
+                        7: last_col,          # outcome
+                        8: first_col,         # input openings
+                        9: last_col}          # output openings
+        return participants.get(phase)
+
+    def get_tally_participants(self):
+        """ Return role indices of the servers that compute the tally. """
+        return self.get_servers_in_col(self.cols-1)
+
     def mix_phase_replicate_input(self, row_index, col_index):
         assert col_index == 0
         election = self.election
@@ -160,55 +212,138 @@ class Server():
         # generate permutations (and inverses) used in each column
         # in practice, these could be generated by row 0 server
         # and sent securely to the others in the same column.
+        j = col_index
+        pi_seeds = dict()
         for race_id in election.race_ids:
-            j = col_index
             rand_name = self.sdb[race_id]['a'][j]['rand_name']
             sv.init_randomness_source(rand_name) # optional - TODO remove after transition to unshared memory only
-            for k in election.k_list:
-                pi = sv.random_permutation(election.p_list, rand_name)
-                pi_inv = sv.inverse_permutation(pi)
-                for i in self.row_list:
-                    self.sdb[race_id][i][j][k]['pi'] = pi
-                    self.sdb[race_id][i][j][k]['pi_inv'] = pi_inv
+            # one seed per (race, column), each pass derives its permutation from it
+            pi_rand_name = sv.split_randomness_source(rand_name, "pi")
+            pi_seeds[race_id] = sv.bytes2hex(sv.randomness_sources[pi_rand_name])
+            self.set_permutations(race_id, self.row_list, j, pi_seeds[race_id])
+            # and one key per set of rows for the obfuscation values (see set_obfuscation_values)
+            fuzz_rand_name = sv.split_randomness_source(rand_name, "fuzz")
+            for i in self.row_list:
+                self.sdb[race_id][i][j]['fuzz_seeds'] = dict()
+            for rows in self.zero_sharing_sets():
+                label = "".join(rows)
+                key_rand_name = sv.split_randomness_source(fuzz_rand_name, label)
+                for i in rows:
+                    self.sdb[race_id][i][j]['fuzz_seeds'][label] = \
+                        sv.bytes2hex(sv.randomness_sources[key_rand_name])
         dict_update_to_share = dict()
         for race_id in election.race_ids:
             dict_update_to_share[race_id] = dict()
             for i in self.row_list:
                 dict_update_to_share[race_id][i] = dict()
-                j = col_index
                 assert type(j)==int
                 dict_update_to_share[race_id][i][j] = dict()
+                if SC.PERMUTATION_SEEDS: # other rows regenerate the permutations
+                    dict_update_to_share[race_id][i][j]['pi_seed'] = pi_seeds[race_id]
+                    continue
                 for k in election.k_list:
                     dict_update_to_share[race_id][i][j][k] = dict()
                     dict_update_to_share[race_id][i][j][k]['pi'] = self.sdb[race_id][i][j][k]['pi']
                     dict_update_to_share[race_id][i][j][k]['pi_inv'] = self.sdb[race_id][i][j][k]['pi_inv']
         return dict_update_to_share
 
+    def mix_phase_fuzz_seeds(self, row_index, col_index, target_row):
+        """ Return the update sending target_row the keys for its obfuscation values
+        in column col_index (with SC.FUZZ_SEEDS), sent to that row only. """
+        assert row_index == 'a'
+        j = col_index
+        dict_update_to_share = dict()
+        for race_id in self.election.race_ids:
+            dict_update_to_share[race_id] = {target_row: {j: {
+                'fuzz_seeds': self.sdb[race_id][target_row][j]['fuzz_seeds']}}}
+        return dict_update_to_share
+
+    def mix_phase_values_from_seeds(self, row_index, col_index):
+        """ Derive the values of server (row_index, col_index) sent as seeds by row 'a'
+        (see mix_phase_generate_permutations): the permutations with SC.PERMUTATION_SEEDS,
+        and the obfuscation values of this row with SC.FUZZ_SEEDS. """
+        j = col_index
+        for race in self.election.races:
+            race_id = race.race_id
+            if SC.PERMUTATION_SEEDS and row_index != 'a': # row 'a' made them
+                rows = [i for i in self.row_list if 'pi_seed' in self.sdb[race_id][i][j]]
+                assert row_index in rows
+                self.set_permutations(race_id, rows, j, self.sdb[race_id][row_index][j]['pi_seed'])
+            if SC.FUZZ_SEEDS:
+                self.set_obfuscation_values(race, [row_index], j)
+
+    def zero_sharing_sets(self):
+        """ Return the sets of rows (tuples, in row order) holding a key of the
+        obfuscation values: all sets of rows+2-threshold rows (none with threshold 1,
+        whose only sharing of 0 is 0). """
+        assert 1 <= self.threshold <= self.rows
+        return list(itertools.combinations(self.row_list, self.rows + 2 - self.threshold))
+
+    def set_obfuscation_values(self, race, rows, j):
+        """ Compute the obfuscation values (fuzz_dict) of the given rows for each pass k
+        in column j of race, from their fuzz_seeds: a pseudorandom sharing of 0 per voter.
+
+        Each set A of zero_sharing_sets has a key, known to the rows in A, from which
+        a value r is drawn per voter; A adds r * f_A(x) to the share at point x of each
+        of its rows, where f_A(x) = x * prod(x - x_i for rows i not in A) has degree
+        threshold-1 and vanishes at 0 and at the other rows.  The sum over all sets is
+        a random sharing of 0 of degree threshold-1, and a row can only compute its
+        own shares, lacking the keys of the sets without it.  (With threshold 2, the
+        sharing is r * x, so any one share of 0 reveals the others anyway.)
+        Each row holds C(rows-1, threshold-2) keys, and draws one stream of n values
+        per key and pass; over all rows, a (race, column) has C(rows, threshold-2) keys.
+        """
+        election = self.election
+        race_id = race.race_id
+        M = race.race_modulus
+        n = len(election.p_list)
+        xs = dict((i, self.row_list.index(i) + 1) for i in self.row_list)
+        for i in rows:
+            fuzz_lists = dict((k, [0] * n) for k in election.k_list)
+            for label, seed in sorted(self.sdb[race_id][i][j]['fuzz_seeds'].items()):
+                f = xs[i]
+                for other in self.row_list:
+                    if other not in label:
+                        f = f * (xs[i] - xs[other]) % M
+                rand_name = "fuzz:" + race_id + ":" + str(j) + ":" + label
+                sv.init_randomness_source(rand_name, sv.hex2bytes(seed))
+                for k in election.k_list:
+                    # independent stream per (race, k), as for the permutations
+                    k_rand_name = sv.split_randomness_source(rand_name, k)
+                    rs = sv.get_random_many_from_source(k_rand_name, n, M)
+                    fuzz_lists[k] = [(y + r * f) % M for y, r in zip(fuzz_lists[k], rs)]
+            for k in election.k_list:
+                # note that fuzz_dict is dict of size n
+                self.sdb[race_id][i][j][k]['fuzz_dict'] = dict(zip(election.p_list, fuzz_lists[k]))
+
+    def set_permutations(self, race_id, rows, j, pi_seed):
+        """ Generate the permutation pi (and pi_inv) of each pass k in column j of race_id
+        from pi_seed (hex), and save them for the given rows. """
+        election = self.election
+        for i in rows:
+            self.sdb[race_id][i][j]['pi_seed'] = pi_seed
+        rand_name = "pi:" + race_id + ":" + str(j)
+        sv.init_randomness_source(rand_name, sv.hex2bytes(pi_seed))
+        for k in election.k_list:
+            # independent stream per (race, k), so passes may be generated in any order
+            k_rand_name = sv.split_randomness_source(rand_name, k)
+            pi = sv.random_permutation(election.p_list, k_rand_name)
+            pi_inv = sv.inverse_permutation(pi)
+            for i in rows:
+                self.sdb[race_id][i][j][k]['pi'] = pi
+                self.sdb[race_id][i][j][k]['pi_inv'] = pi_inv
+
     def mix_phase_generate_obfuscation_values(self, row_index, col_index):
         assert row_index == 'a'
         election = self.election
         # generate obfuscation values used in each column
         # in practice, these could be generated by row 0 server
         # and sent securely to the others in the same column.
+        # (with SC.FUZZ_SEEDS, each row derives its own instead)
         for race in election.races:
             race_id = race.race_id
             j = col_index
-            rand_name = self.sdb[race_id]['a'][j]['rand_name']
-            for k in election.k_list:
-                fuzz_dict = dict()      # fuzz_dict[i][pnn]
-                for i in self.row_list:
-                    fuzz_dict[i] = dict()
-                for v in election.p_list:
-                    share_list = sv.share(0,
-                                          self.rows,
-                                          self.threshold,
-                                          rand_name,
-                                          race.race_modulus)
-                    for row, i in enumerate(self.row_list):
-                        fuzz_dict[i][v] = share_list[row][1]
-                for i in self.row_list:
-                    # note that fuzz_dict[i] is dict of size n
-                    self.sdb[race_id][i][j][k]['fuzz_dict'] = fuzz_dict[i]
+            self.set_obfuscation_values(race, self.row_list, j)
         dict_update_to_share = dict()
         for race_id in election.race_ids:
             dict_update_to_share[race_id] = dict()
@@ -222,49 +357,54 @@ class Server():
                     dict_update_to_share[race_id][i][j][k]['fuzz_dict'] = self.sdb[race_id][i][j][k]['fuzz_dict']
         return dict_update_to_share
 
-    def mix_phase_process_left_to_right(self, row_index, col_index):
-        """This code requires inter-processor communication. """
+    def mix_phase_process_left_to_right(self, row_index, col_index, passes=None):
+        """This code requires inter-processor communication.
+        Mix the given (race_id, k) passes (default: all of them) and return the update to share.
+        """
 
         election = self.election
+        p_list = election.p_list
+        p_index = {p: index for index, p in enumerate(p_list)}
+        if passes == None:
+            passes = [(race_id, k) for race_id in election.race_ids for k in election.k_list]
+        race_moduli = {race.race_id: race.race_modulus for race in election.races}
         # process columns left-to-right, mixing as you go
-        for race in self.election.races:
-            race_id = race.race_id
-            race_modulus = race.race_modulus
-            j = col_index
-            for k in election.k_list:
-                i = row_index # server has information to mix only for itself
-                # shuffle first
-                pi = self.sdb[race_id][i][j][k]['pi'] # length n
-                # note that pi is independent of i
-                x = self.sdb[race_id][i][j][k]['x']   # length n
-                xp = sv.apply_permutation(pi, x)      # length n
-                # then obfuscate by adding "fuzz"
-                fuzz_dict = self.sdb[race_id][i][j][k]['fuzz_dict']
-                xpo = dict()
-                for v in election.p_list:
-                    xpo[v] = (xp[v] + fuzz_dict[v]) % race_modulus
-                y = xpo
-                self.sdb[race_id][i][j][k]['y'] = y
-                # this column's y's become next column's x's.
-                # in practice would be sent via secure channels
-                if j < self.cols - 1:
-                    self.sdb[race_id][i][j+1][k]['x'] = y
-        dict_update_to_share = dict()
-        for race_id in election.race_ids:
-            dict_update_to_share[race_id] = dict()
-            i = row_index
-            dict_update_to_share[race_id][i] = dict()
-            j = col_index
-            assert type(j)==int
-            dict_update_to_share[race_id][i][j] = dict()
+        i = row_index # server has information to mix only for itself
+        j = col_index
+        work_args = []
+        for race_id, k in passes:
+            # shuffle first
+            pi = self.sdb[race_id][i][j][k]['pi'] # length n
+            # note that pi is independent of i
+            x = self.sdb[race_id][i][j][k]['x']   # length n
+            # then obfuscate by adding "fuzz"
+            fuzz_dict = self.sdb[race_id][i][j][k]['fuzz_dict']
+            work_args.append(([x[p] for p in p_list],
+                              [fuzz_dict[p] for p in p_list],
+                              sv_vector.permutation_index(pi, p_list, p_index),
+                              race_moduli[race_id]))
+        if SC.PARALLEL_MIXING:
+            results = sv_parallel.map_work(mix_pass, work_args, SC.WORKER_PROCESSES)
+        else:
+            results = [mix_pass(*args) for args in work_args]
+        for (race_id, k), y_list in zip(passes, results):
+            y = dict(zip(p_list, y_list))
+            self.sdb[race_id][i][j][k]['y'] = y
+            # this column's y's become next column's x's.
+            # in practice would be sent via secure channels
             if j < self.cols - 1:
-                dict_update_to_share[race_id][i][j+1] = dict()
-            for k in election.k_list:
-                dict_update_to_share[race_id][i][j][k] = dict()
-                dict_update_to_share[race_id][i][j][k]['y'] = self.sdb[race_id][i][j][k]['y']
+                self.sdb[race_id][i][j+1][k]['x'] = y
+        dict_update_to_share = dict()
+        for race_id, k in passes:
+            if race_id not in dict_update_to_share:
+                dict_update_to_share[race_id] = {i: {j: dict()}}
                 if j < self.cols - 1:
-                    dict_update_to_share[race_id][i][j+1][k] = dict()
-                    dict_update_to_share[race_id][i][j+1][k]['x'] = self.sdb[race_id][i][j+1][k]['x']
+                    dict_update_to_share[race_id][i][j+1] = dict()
+            dict_update_to_share[race_id][i][j][k] = dict()
+            dict_update_to_share[race_id][i][j][k]['y'] = self.sdb[race_id][i][j][k]['y']
+            if j < self.cols - 1:
+                dict_update_to_share[race_id][i][j+1][k] = dict()
+                dict_update_to_share[race_id][i][j+1][k]['x'] = self.sdb[race_id][i][j+1][k]['x']
         return dict_update_to_share
 
     def test_mix(self):
@@ -312,4 +452,54 @@ def get_num_servers(n_fail, n_leak):
     rows = rows
     cols = cols
     threshold = threshold
-    return rows*cols
\ No newline at end of file
+    return rows*cols
+
+def mix_pass(x_list, fuzz_list, index, race_modulus):
+    """ Return y_list of one (race, k) pass of a mix server.
+
+    y[s] = (x[index[s]] + fuzz[s]) % race_modulus: the x's are shuffled
+    by the permutation with that index (see sv_vector.permutation_index),
+    then obfuscated by adding the fuzz.  Module-level, so that it can run
+    in a worker process (see sv_parallel.map_work).
+    """
+    return sv_vector.add_mod(x_list, fuzz_list, race_modulus, index=index)
+
+def test_zero_sharing():
+    """ Test that the obfuscation values are sharings of 0, and that each row
+    derives from its own keys the values row 'a' computes for all rows. """
+    import types
+    M = 2**31 - 1
+    race = types.SimpleNamespace(race_id="race1", race_modulus=M)
+    election = types.SimpleNamespace(races=[race], race_ids=[race.race_id],
+                                     k_list=sv.k_list(2),
+                                     p_list=["p%d" % v for v in range(10)])
+    for n_fail, n_leak in [(0, 1), (1, 1), (1, 2), (2, 1), (2, 2)]:
+        server_a = Server(election, n_fail, n_leak)
+        rows, threshold = server_a.rows, server_a.threshold
+        update = server_a.mix_phase_generate_permutations('a', 0)
+        server_a.mix_phase_generate_obfuscation_values('a', 0)
+        sdb_a = server_a.sdb[race.race_id]
+        for i in server_a.row_list[1:]:
+            server = Server(election, n_fail, n_leak)
+            sv.update_nested_dict(server.sdb, update)
+            sv.update_nested_dict(server.sdb, server_a.mix_phase_fuzz_seeds('a', 0, i))
+            fuzz_seeds = server.sdb[race.race_id][i][0]['fuzz_seeds']
+            assert len(fuzz_seeds) == len(list(itertools.combinations(range(rows-1), threshold-2)))
+            assert all(i in label for label in fuzz_seeds)
+            server.set_obfuscation_values(race, [i], 0)
+            for k in election.k_list:
+                assert server.sdb[race.race_id][i][0][k]['fuzz_dict'] == sdb_a[i][0][k]['fuzz_dict']
+        for k in election.k_list:
+            share_lists = [[(x+1, sdb_a[i][0][k]['fuzz_dict'][p])
+                            for x, i in enumerate(server_a.row_list)]
+                           for p in election.p_list]
+            for shares in share_lists:
+                for subset in itertools.combinations(shares, threshold):
+                    assert sv.lagrange(list(subset), rows, threshold, M) == 0
+            # but not sharings of lower degree
+            assert any(sv.lagrange(shares[1:threshold], rows, threshold-1, M) != 0
+                       for shares in share_lists)
+
+if __name__ == "__main__":
+    test_zero_sharing()
+    print("sv_server.py self-tests passed")
@@ -13,29 +13,35 @@ import sys
 
 import sv
 
-def compute_tally(election):
+def compute_tally(election, k_list=None, row_list=None):
     """ Compute tallies for this election.
 
-    Data is from last column of mix servers.
+    Data is from last column of mix servers: the y's of passes k_list
+    (default: all) of rows row_list (default: all, else at least
+    threshold of them).
     """
     server = election.server
     cols = server.cols
+    if k_list == None:
+        k_list = election.k_list # TODO this should be output production list
+    if row_list == None:
+        row_list = server.row_list
+    x = [server.row_list.index(i) + 1 for i in row_list]
     election.tally = dict()
     for race in election.races:
         race_id = race.race_id
-        for k in election.k_list: # TODO this should be output production list
-            choice_int_list = []
-            for p in election.p_list:
-                share_list = \
-                    [(row+1, server.sdb[race_id][i][cols-1][k]['y'][p]) \
-                     for row, i in enumerate(election.server.row_list)]
-                choice_int = sv.lagrange(share_list, server.rows,\
-                                         server.threshold, race.race_modulus)
-                choice_int_list.append(choice_int)
+        for k in k_list:
+            # y_lists[row] has the shares of row for all voters
+            y_lists = \
+                [[server.sdb[race_id][i][cols-1][k]['y'][p] \
+                  for p in election.p_list] \
+                 for i in row_list]
+            choice_int_list = sv.lagrange_many(y_lists, server.rows,\
+                                               server.threshold, race.race_modulus, x)
             choice_str_list = [race.choice_int2str(choice_int)
                                for choice_int in choice_int_list]
             choice_str_list = sorted(choice_str_list)
-            if k == election.k_list[0]: # TODO this should be output production list
+            if k == k_list[0]:
                 last_choice_str_list = choice_str_list
             else:
                 assert choice_str_list == last_choice_str_list
@@ -0,0 +1,128 @@
+# sv_vector.py
+# python3
+
+""" Vector arithmetic modulo a race modulus.
+
+Mixing, t-values and tallies do the same modular operation for every
+voter of a (race, k) pass.  The functions here take such columns of
+values as lists (in p_list order) and return lists of python ints.
+When NumPy is installed and the modulus is small enough, the work is
+done on uint64 arrays; otherwise (or with USE_NUMPY False) it is done
+with python ints.  Both give the same results.
+
+Permutations are given as index lists: index[s] is the position in the
+input of the value that ends up in position s (see permutation_index).
+"""
+
+# MIT open-source license.
+# (See https://github.com/ron-rivest/split-value-voting.git)
+
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+USE_NUMPY = True
+# residues below 2**32, so a product of two of them fits in a uint64
+NUMPY_MAX_MODULUS = 2**32
+
+def use_numpy(M):
+    """ Return True if arithmetic modulo M is done with NumPy. """
+    return numpy is not None and USE_NUMPY and M <= NUMPY_MAX_MODULUS
+
+def to_uint64(values):
+    """ Return list of ints in range(2**64) values as a uint64 array. """
+    # going through array.array is several times faster than numpy.array
+    return numpy.frombuffer(array.array('Q', values), dtype=numpy.uint64)
+
+def to_index(index):
+    """ Return index list as an array NumPy can index with. """
+    return numpy.frombuffer(array.array('q', index), dtype=numpy.int64)
+
+def permutation_index(perm, p_list, p_index=None):
+    """ Return index list of permutation perm (a dict or sv.Permutation on p_list).
+
+    As in sv.apply_permutation, the value at position perm[p] ends up
+    at position p.  p_index maps p_list elements to their positions.
+    """
+    if not isinstance(perm, dict) and perm.elts is p_list:
+        return perm.index       # already an index array
+    if p_index == None:
+        p_index = {p: index for index, p in enumerate(p_list)}
+    return [p_index[perm[p]] for p in p_list]
+
+def add_mod(a, b, M, index=None):
+    """ Return [(a[index[s]] + b[s]) % M], or [(a[s] + b[s]) % M] if no index.
+
+    Values of a and b are in range(M).
+    """
+    if use_numpy(M):
+        a = to_uint64(a)
+        if index != None:
+            a = a[to_index(index)]
+        return ((a + to_uint64(b)) % numpy.uint64(M)).tolist()
+    if index != None:
+        a = [a[s] for s in index]
+    return [(x + y) % M for x, y in zip(a, b)]
+
+def sub_mod(a, b, M, index=None):
+    """ Return [(a[index[s]] - b[s]) % M], or [(a[s] - b[s]) % M] if no index.
+
+    Values of a and b are in range(M).
+    """
+    if use_numpy(M):
+        a = to_uint64(a)
+        if index != None:
+            a = a[to_index(index)]
+        M64 = numpy.uint64(M)
+        # a + (M - b) avoids negative intermediate values
+        return ((a + (M64 - to_uint64(b))) % M64).tolist()
+    if index != None:
+        a = [a[s] for s in index]
+    return [(x - y) % M for x, y in zip(a, b)]
+
+def dot_mod(coefficients, y_lists, M):
+    """ Return [sum(c[r] * y_lists[r][s] for r) % M] for each s.
+
+    Values of coefficients and y_lists are in range(M); there is one
+    y_list per coefficient.
+    """
+    assert len(coefficients) == len(y_lists)
+    if use_numpy(M):
+        M64 = numpy.uint64(M)
+        secrets = numpy.zeros(len(y_lists[0]), dtype=numpy.uint64)
+        for c, ys in zip(coefficients, y_lists):
+            # each product is below 2**64, and each sum below 2**33
+            terms = (to_uint64(ys) * numpy.uint64(c)) % M64
+            secrets = (secrets + terms) % M64
+        return secrets.tolist()
+    secrets = [0] * len(y_lists[0])
+    for c, ys in zip(coefficients, y_lists):
+        secrets = [secret + c * y for secret, y in zip(secrets, ys)]
+    return [secret % M for secret in secrets]
+
+def test_vector():
+    """ Test that both engines give the same results. """
+    global USE_NUMPY
+    use_numpy = USE_NUMPY
+    try:
+        for M in [2, 11, 2**31 - 1, 2**32, 2**61 - 1, 2**64 + 13,
+                  2**127 - 1, 2**128 + 51, 2**191 - 19]:
+            a = [(7**s) % M for s in range(100)] + [M-1, M-1, 0]
+            b = [(3**s) % M for s in range(100)] + [M-1, 0, M-1]
+            index = [(5*s) % 103 for s in range(103)]
+            results = []
+            for USE_NUMPY in [True, False]:
+                results.append((add_mod(a, b, M, index), sub_mod(a, b, M, index),
+                                sub_mod(a, b, M), dot_mod([M-1, 2], [a, b], M)))
+            assert results[0] == results[1]
+            assert results[1][0][1] == (a[5] + b[1]) % M
+    finally:
+        USE_NUMPY = use_numpy
+
+if __name__ == "__main__":
+    test_vector()
+    print("sv_vector.py self-tests passed (NumPy %s)" %
+          ("not installed" if numpy == None else numpy.__version__))
@@ -116,6 +116,16 @@ def isdict(d, keys=None):
         return False
     return isinstance(d, dict) and (keys == None or has_keys(d, keys))
 
+def check_commitments(commitments, values, keys):
+    """ Check that commitments[i] == sv.com(values[i], keys[i]) for all i.
+
+    Commitments and keys are base64 strings, as posted on the SBB.
+    """
+    assert all(isinstance(key, str) and \
+               len(key) == (sv.SECPARAM_SYMMETRIC // 6) + 2 for key in keys)
+    digests = sv.com_many(values, [sv.base64_2_bytes(key) for key in keys])
+    assert commitments == [sv.bytes2base64(digest) for digest in digests]
+
 def verify(sbb_filename):
     """ Perform all possible verifications on the given file. """
 
@@ -490,6 +500,10 @@ def check_opened_output_commitments(sbb_dict, db):
         sbb_dict['proof:outcome_check']\
                 ['opened_output_commitments']
     assert isdict(coms, db['race_ids'])
+    # openings to check, as columns for check_commitments
+    commitments = []
+    values = []
+    keys = []
     for race_id in db['race_ids']:
         assert isdict(coms[race_id], db['opl']), "sv.dumps(coms[race_id]): " + sv.dumps(coms[race_id]) + " db['opl']: " + sv.dumps(db['opl'])
         for k in db['opl']:
@@ -517,8 +531,10 @@ def check_opened_output_commitments(sbb_dict, db):
                          ['commitments'][race_id][k][p][i]['cu']
                     cv = sbb_dict['proof:output_commitments']\
                          ['commitments'][race_id][k][p][i]['cv']
-                    assert cu == sv.com(u, ru)
-                    assert cv == sv.com(v, rv)
+                    commitments.extend((cu, cv))
+                    values.extend((u, v))
+                    keys.extend((ru, rv))
+    check_commitments(commitments, values, keys)
     print('check_opened_output_commitments: passed.')
 
 def check_opened_output_commitment_tallies(sbb_dict, db):
@@ -537,15 +553,14 @@ def check_opened_output_commitment_tallies(sbb_dict, db):
                 ['ballot_style_race_dict'][race_id]['choices']:
                 if choice[0] != '*':
                     tally_k[race_id][choice] = 0
-            for p in db['p_list']:
-                share_list = []
-                for i_int, i in enumerate(db['row_list']):
-                    y = opened_coms[race_id][k][p][i]['y']
-                    share_list.append((i_int+1, y))
-                w = sv.lagrange(share_list,
-                                db['rows'],
-                                db['threshold'],
-                                db['races'][race_id]['race_modulus'])
+            y_lists = [[opened_coms[race_id][k][p][i]['y']
+                        for p in db['p_list']]
+                       for i in db['row_list']]
+            w_list = sv.lagrange_many(y_lists,
+                                      db['rows'],
+                                      db['threshold'],
+                                      db['races'][race_id]['race_modulus'])
+            for w in w_list:
                 # convert w back to string version of choice
                 # see sv_race.choice_int2str
                 choice_bytes = sv.int2bytes(w)
@@ -589,6 +604,9 @@ def check_input_consistency_input_openings(sbb_dict, db):
     oc = sbb_dict['proof:input_consistency:input_openings']\
                  ['opened_commitments']
     cv = sbb_dict['casting:votes']['cast_vote_dict']
+    commitments = []
+    values = []
+    keys = []
     for race_id in db['races']:
         ocr = oc[race_id]
         cvr = cv[race_id]
@@ -599,11 +617,14 @@ def check_input_consistency_input_openings(sbb_dict, db):
                 ocrpi = ocrp[i]
                 cvrpi = cvrp[i]
                 if 'u' in ocrpi:
-                    assert cvrpi['cu'] == sv.com(ocrpi['u'],
-                                                 ocrpi['ru'])
+                    commitments.append(cvrpi['cu'])
+                    values.append(ocrpi['u'])
+                    keys.append(ocrpi['ru'])
                 else:
-                    assert cvrpi['cv'] == sv.com(ocrpi['v'],
-                                                 ocrpi['rv'])
+                    commitments.append(cvrpi['cv'])
+                    values.append(ocrpi['v'])
+                    keys.append(ocrpi['rv'])
+    check_commitments(commitments, values, keys)
     print('check_input_consistency_input_openings: passed.')
 
 def check_input_consistency_output_openings(sbb_dict, db):
@@ -613,6 +634,9 @@ def check_input_consistency_output_openings(sbb_dict, db):
     oooc = sbb_dict['proof:input_consistency:output_openings']\
                    ['opened_commitments']
     occ = sbb_dict['proof:output_commitments']['commitments']
+    commitments = []
+    values = []
+    keys = []
     for race_id in db['races']:
         ooocr = oooc[race_id]
         occr = occ[race_id]
@@ -626,11 +650,14 @@ def check_input_consistency_output_openings(sbb_dict, db):
                     ooocrkpi = ooocrkp[i]
                     occrkpi = occrkp[i]
                     if 'u' in ooocrkpi:
-                        assert occrkpi['cu'] == sv.com(ooocrkpi['u'],
-                                                       ooocrkpi['ru'])
+                        commitments.append(occrkpi['cu'])
+                        values.append(ooocrkpi['u'])
+                        keys.append(ooocrkpi['ru'])
                     else:
-                        assert occrkpi['cv'] == sv.com(ooocrkpi['v'],
-                                                       ooocrkpi['rv'])
+                        commitments.append(occrkpi['cv'])
+                        values.append(ooocrkpi['v'])
+                        keys.append(ooocrkpi['rv'])
+    check_commitments(commitments, values, keys)
     print('check_input_consistency_output_openings: passed.')
 
 def check_input_consistency_t_values(sbb_dict, db):
@@ -654,11 +681,12 @@ def check_input_consistency_t_values(sbb_dict, db):
                    ['opened_commitments'][race_id][k]
             #  icom maps p, i to {"ru":.., "u":..} or {"rv":.., "v":..}
             #  ocom maps p, i to {"ru":.., "u":..} or {"rv":.., "v":..}
+            # tu_lists[row] and tv_lists[row] have t-values of row for all voters
+            tu_lists = [[] for i in db['row_list']]
+            tv_lists = [[] for i in db['row_list']]
             for py in db['p_list']:
                 px = pik[py]
-                tu_list = []
-                tv_list = []
-                for i in db['row_list']:
+                for row, i in enumerate(db['row_list']):
                     icompi = icom[px][i]
                     ocompi = ocom[py][i]
                     assert set(icompi.keys()) == set(ocompi.keys())
@@ -676,15 +704,14 @@ def check_input_consistency_t_values(sbb_dict, db):
                         ouv = ocompi['v']
                         tuv = t_value_dict['tv']
                     assert tuv == (ouv-iuv) % race_modulus
-                    tu_list.append(t_value_dict['tu'])
-                    tv_list.append(t_value_dict['tv'])
-                # check that tu_list and tv_list lagrange to (t, -t)
-                tu_list = list(enumerate(tu_list, 1))
-                tu0 = sv.lagrange(tu_list, db['rows'], db['threshold'],
-                                  race_modulus)
-                tv_list = list(enumerate(tv_list, 1))
-                tv0 = sv.lagrange(tv_list, db['rows'], db['threshold'],
-                                  race_modulus)
+                    tu_lists[row].append(t_value_dict['tu'])
+                    tv_lists[row].append(t_value_dict['tv'])
+            # check that t-values of each voter lagrange to (t, -t)
+            tu0_list = sv.lagrange_many(tu_lists, db['rows'], db['threshold'],
+                                        race_modulus)
+            tv0_list = sv.lagrange_many(tv_lists, db['rows'], db['threshold'],
+                                        race_modulus)
+            for tu0, tv0 in zip(tu0_list, tv0_list):
                 assert ((tu0 + tv0) % race_modulus) == 0
     print('check_input_consistency_t_values: passed.')
 
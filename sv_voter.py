@@ -48,7 +48,10 @@ class Voter:
         px = self.px
 
         # cast random vote (for this simulation, it's random)
-        choice_str = race.random_choice()            # returns a string
+        # drawn from a stream of the race's source for this voter only, so
+        # voters may cast their votes in any order (or in parallel)
+        choice_rand_name = sv.split_randomness_source(race.rand_name, self.voter_id)
+        choice_str = race.random_choice(choice_rand_name)  # returns a string
         choice_int = race.choice_str2int(choice_str) # convert to integer
 
         # ballot_id is random hex string of desired length
@@ -69,13 +72,21 @@ class Voter:
         # then strip off indices, since they are equal to row number + 1
         share_list = [share[1] for share in share_list]
 
+        # split values and commitment keys for each row
+        sv_pairs = []
+        keys = []
+        for x in share_list:
+            sv_pairs.append(sv.get_sv_pair(x, rand_name, race_modulus))
+            keys.extend(sv.get_random_many_from_source(rand_name, 2))
+        # commit to all u's and v's of the ballot at once
+        values = [value for sv_pair in sv_pairs for value in sv_pair]
+        coms = sv.com_many(values, keys)
+
         # save ballots on election data structure
         for row, x in enumerate(share_list):
-            (u, v) = sv.get_sv_pair(x, rand_name, race_modulus)
-            ru = sv.bytes2base64(sv.get_random_from_source(rand_name))
-            rv = sv.bytes2base64(sv.get_random_from_source(rand_name))
-            cu = sv.com(u, ru)
-            cv = sv.com(v, rv)
+            (u, v) = sv_pairs[row]
+            ru, rv = [sv.bytes2base64(r) for r in keys[2*row:2*row+2]]
+            cu, cv = [sv.bytes2base64(c) for c in coms[2*row:2*row+2]]
             i = election.server.row_list[row]
             vote = {"ballot_id": ballot_id, "x": x, "u": u, "v": v,
                     "ru": ru, "rv": rv, "cu": cu, "cv": cv}